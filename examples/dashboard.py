@@ -240,8 +240,19 @@ if project:
         st.stop()
 
     body.write('## Agreement Statistics')
-    iaa = view.iaa(measure=iaa_type)
-    body.metric(label=iaa_type, value=str(np.round(iaa, 4)))
+    if iaa_type != 'gamma' and view.count() > 1_000_000:
+        # show estimates from growing samples of sentences until the exact value is available
+        iaa_metric = body.empty()
+        for estimate in view.iter_iaa_estimates(measure=iaa_type):
+            if estimate.fraction < 1:
+                iaa_metric.metric(label=f'{iaa_type} (estimated from {estimate.fraction:.0%} of sentences)',
+                                  value=str(np.round(estimate.estimate, 4)),
+                                  help=f'95% interval: {estimate.lower:.4f} - {estimate.upper:.4f}')
+            else:
+                iaa_metric.metric(label=iaa_type, value=str(np.round(estimate.estimate, 4)))
+    else:
+        iaa = view.iaa(measure=iaa_type)
+        body.metric(label=iaa_type, value=str(np.round(iaa, 4)))
     body.write(view.pairwise_kappa())
 
     body.write('### IAA by Label')
@@ -254,13 +265,11 @@ if project:
     )
 
     if individual_iaa_labels:
-        if iaa_type == 'gamma':
-            iaa_label_scores = [view.filter_labels(label).iaa(measure=iaa_type) for label in individual_iaa_labels]
-            body.write(pd.Series(iaa_label_scores, index=individual_iaa_labels, name=iaa_type))
-        else:
-            body.warning('Unitising IAA per Label is currently only supported for the _gamma_ IAA measure. '
-                         'Please select the appropriate IAA statistic on the left. '
-                         'Keep in mind that calculating the _gamma_ measure per label may take a while.')
+        # gamma per label only considers annotations with the label, other measures compare it to all other labels
+        label_view = view.filter_labels(individual_iaa_labels) if iaa_type == 'gamma' else view
+        body.write(label_view.iaa_by_label(measure=iaa_type)[individual_iaa_labels])
+        if iaa_type != 'gamma':
+            body.caption('Agreement per label treats each label as a binary category against all other labels.')
 
     body.write('## Confusion Matrices')
     only_differences = body.checkbox('Display only differences', False)
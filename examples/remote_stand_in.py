@@ -0,0 +1,155 @@
+"""
+Local stand-in for the Remote API of an Inception instance, serving the projects contained in zipped XMI exports.
+Useful for trying out and benchmarking Project.from_remote without an Inception instance.
+
+Usage: python remote_stand_in.py path/to/export.zip --port 8080 --latency 0.05
+
+The project can then be loaded with Project.from_remote(1, 'http://localhost:8080', ('user', 'password')).
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile
+
+from inceptalytics.utils import annotation_zip_paths
+
+
+class ExportBackend:
+    """Answers Remote API requests from a zipped XMI export. Documents are numbered in order of their names."""
+
+    def __init__(self, export_path, project_name='example-project'):
+        self.export_path = export_path
+        self.project_name = project_name
+        self.archives = {}  # (document name, user) -> bytes of the nested annotation archive
+        self.timestamps = {}  # (document name, user) -> modification timestamp, unknown until updated
+
+        with ZipFile(export_path) as project_zip:
+            for file_path in annotation_zip_paths(project_zip):
+                content = project_zip.read(file_path)
+                with ZipFile(BytesIO(content)) as annotation_zip:
+                    cas_file = next(f for f in annotation_zip.namelist() if f.endswith('.xmi'))
+                document = Path(file_path).parent.name
+                user = 'CURATION_USER' if '/curation/' in file_path else Path(cas_file).stem
+                self.archives[document, user] = content
+
+        self.documents = sorted({document for document, _ in self.archives})
+
+    def update(self, document, user, content, timestamp=None):
+        """Adds or replaces an annotation document, e.g. to simulate annotators at work."""
+        if document not in self.documents:
+            self.documents.append(document)
+        self.archives[document, user] = content
+        self.timestamps[document, user] = timestamp
+
+    def remove(self, document, user):
+        """Removes an annotation document."""
+        del self.archives[document, user]
+        self.timestamps.pop((document, user), None)
+
+    def document_state(self, document):
+        curated = (document, 'CURATION_USER') in self.archives
+        return 'CURATION-COMPLETE' if curated else 'ANNOTATION-IN-PROGRESS'
+
+    def respond(self, path):
+        """Returns a tuple (status, content type, body) for a GET request to the given path of the API."""
+        routes = [
+            (r'/projects', self.projects),
+            (r'/projects/1/documents', self.document_list),
+            (r'/projects/1/documents/(\d+)/annotations', self.annotation_list),
+            (r'/projects/1/documents/(\d+)/annotations/([^/]+)', self.annotation),
+            (r'/projects/1/documents/(\d+)/curation', lambda document_id: self.annotation(document_id, 'CURATION_USER')),
+            (r'/projects/1/export.zip', self.export),
+        ]
+        for pattern, route in routes:
+            match = re.fullmatch('/api/aero/v1' + pattern, path)
+            if match:
+                try:
+                    return route(*match.groups())
+                except (KeyError, IndexError):
+                    return 404, 'application/json', self._json([])
+        return 404, 'application/json', self._json([])
+
+    @staticmethod
+    def _json(body):
+        return json.dumps({'messages': [], 'body': body}).encode('utf-8')
+
+    def projects(self):
+        return 200, 'application/json', self._json([{'id': 1, 'name': self.project_name}])
+
+    def document_list(self):
+        return 200, 'application/json', self._json([
+            {'id': i, 'name': document, 'state': self.document_state(document)}
+            for i, document in enumerate(self.documents)
+        ])
+
+    def annotation_list(self, document_id):
+        document = self.documents[int(document_id)]
+        users = sorted(user for d, user in self.archives if d == document and user != 'CURATION_USER')
+        return 200, 'application/json', self._json([
+            {'user': user, 'state': 'IN-PROGRESS', 'timestamp': self.timestamps.get((document, user))}
+            for user in users
+        ])
+
+    def annotation(self, document_id, user):
+        return 200, 'application/zip', self.archives[self.documents[int(document_id)], user]
+
+    def export(self):
+        return 200, 'application/zip', Path(self.export_path).read_bytes()
+
+
+def handler_class(backend, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def do_GET(self):
+            time.sleep(latency)
+            status, content_type, body = backend.respond(self.path.split('?')[0])
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+@contextmanager
+def serve_export(export, port=0, latency=0.0):
+    """
+    Serves the given export in a background thread and yields the url of the stand-in instance. The export can be given
+    as a path or as an ExportBackend, which can be modified while it is served.
+    """
+    backend = export if isinstance(export, ExportBackend) else ExportBackend(export)
+    server = ThreadingHTTPServer(('localhost', port), handler_class(backend, latency))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://localhost:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('export_path', nargs='?', default='../data/Example_Project_POS.zip')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering a request.')
+    args = parser.parse_args()
+
+    with serve_export(args.export_path, args.port, args.latency) as url:
+        print(f'Serving {args.export_path} at {url}, press Ctrl+C to stop.')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -1,25 +1,34 @@
 """The core functionalities of the package. Contains the two main classes Project and View."""
 
+import warnings
+from functools import partial
 from io import BytesIO
-from itertools import combinations
-from typing import Union, Sequence, List, Tuple
+from typing import Union, Sequence, List, Tuple, Dict
+from weakref import WeakKeyDictionary
+from zipfile import ZipFile
 
 import cassis
 import numpy as np
 import pandas as pd
-from krippendorff import alpha
 from pycaprio import Pycaprio
 from pycaprio.mappings import InceptionFormat
-from sklearn.metrics import cohen_kappa_score
 
 from inceptalytics.utils import extend_layer_name, annotation_info_from_xmi_zip, source_files_from_xmi_zip, get_dtype, \
-    confusion_matrix, percentage_agreement, SENTENCE_TYPE_NAME, zero_diag_cm_df
-from inceptalytics.utils import gamma_agreement, construct_feature_path
+    align_spans, decode_categoricals, ensure_list, label_mask, sentence_label_mask, \
+    CountCube, majority_vote, dawid_skene, kappa_from_agreement, percentage_from_agreement, \
+    krippendorff_alpha, AgreementStatistics, pairwise_confusions, agreement_from_confusions, \
+    confusion_matrices_from_pairs, annotator_pairs, annotator_unit_index, one_vs_rest_agreement, one_vs_rest_alpha, \
+    coincidence_matrix, coincidence_entries, pairwise_confusion_entries, alpha_replicates, pairwise_replicates, \
+    bootstrap, bootstrap_chunk_size, AgreementEstimate, annotator_sets, stratified_order, exact_units
+from inceptalytics.utils import annotation_index_from_xmi_zip, CasLoader, AnnotationCache, \
+    SentenceIndex, LRUCache, ProjectStore, RemoteLoader, run_sync, concat_annotations
+from inceptalytics.utils import gamma_agreement, gamma_agreement_by_label, iter_gamma_agreement, construct_feature_path
 
 
 class Project:
     @classmethod
-    def from_remote(cls, project: Union[int, str], remote_url: str = None, auth: Tuple[str, str] = None):
+    def from_remote(cls, project: Union[int, str], remote_url: str = None, auth: Tuple[str, str] = None,
+                    max_connections: int = None):
         """Loads an Inception project from a remote host. Note the following requirements for this to work:
 
         - The Remote API must be enabled for the INCEpTION instance at the remote url.
@@ -33,7 +42,20 @@ class Project:
                 environment variable.
             auth: Tuple consisting of username and password for authentication. If not provided, it is read from the
                 INCEPTION_USERNAME and INCEPTION_PASSWORD environment variables.
+            max_connections: If set, annotation documents are downloaded one by one instead of as a single project
+                export, with at most max_connections concurrent requests, and parsed as they arrive. See RemoteLoader.
         """
+        if max_connections is not None:
+            loader = RemoteLoader(remote_url, auth, max_connections=max_connections)
+            try:
+                typesystem, annotations, source_files, states = loader.load_sync(project)
+            finally:
+                loader.close()
+            loaded = cls(annotations, source_files, loader.base_url, 'xmi')
+            loaded._remote = {'project': project, 'remote_url': remote_url, 'auth': auth,
+                              'max_connections': max_connections, 'typesystem': typesystem, 'states': states}
+            return loaded
+
         client = Pycaprio(remote_url, authentication=auth)
 
         if isinstance(project, str):
@@ -49,20 +71,78 @@ class Project:
         return cls.from_zipped_xmi(BytesIO(zip_content))
 
     @classmethod
-    def from_zipped_xmi(cls, project_path):
+    def from_zipped_xmi(cls, project_path, lazy: bool = False, max_cached_cas: int = 128,
+                        cache_dir: str = None):
         """
         Loads an Inception project exported to XMI format, located at the given path.
 
         Args:
             project_path: A string representing the path to the exported project or a filelike object representing a zip
                 file.
+            lazy: If set to true, only an index of the annotation documents is built when loading. CAS objects are
+                deserialized when they are first needed, e.g. by Project.select. The export must stay accessible for
+                the lifetime of the project.
+            max_cached_cas: Maximum number of deserialized CAS objects kept in memory when lazy is set. If None, all
+                deserialized CAS objects are kept.
+            cache_dir: Directory in which annotation tables extracted by Project.select are cached across sessions.
+                Cached tables are invalidated when the contents of the export change. Implies lazy, so that selections
+                of cached tables on an unchanged export do not deserialize any CAS. The index of the annotation
+                documents is cached as well, so reopening an unchanged export does not open its annotation archives.
+                Requires pyarrow, installed with the 'cache' extra.
+        """
+        # the export is opened once and shared by all readers, a lazy project keeps it open in its CasLoader
+        project_zip = ZipFile(project_path)
+        try:
+            source_files = source_files_from_xmi_zip(project_zip)
+            annotation_cache = AnnotationCache(cache_dir, project_zip) if cache_dir is not None else None
+
+            if annotation_cache is not None:
+                cached_index = annotation_cache.load_index()
+                if cached_index is None:
+                    cached_index = annotation_index_from_xmi_zip(project_zip)
+                    annotation_cache.store_index(*cached_index)
+                typesystem, annotations = cached_index
+            elif lazy:
+                typesystem, annotations = annotation_index_from_xmi_zip(project_zip)
+
+            if lazy or annotation_cache is not None:
+                cas_loader = CasLoader(project_zip, typesystem, max_cached=max_cached_cas)
+                return cls(annotations, source_files, project_path, 'xmi', cas_loader=cas_loader,
+                           annotation_cache=annotation_cache)
+
+            annotations = annotation_info_from_xmi_zip(project_zip)
+        except BaseException:
+            project_zip.close()
+            raise
+
+        project_zip.close()
+        return cls(annotations, source_files, project_path, 'xmi', annotation_cache=annotation_cache)
+
+    @classmethod
+    def open_store(cls, store_path, select_cache_size: int = 32):
+        """
+        Opens a project written by Project.save_store. No CAS is parsed: annotation tables are read from the
+        memory-mapped arrays of the store, and only the rows of selected documents are read. The project does not
+        contain CAS objects.
+
+        Args:
+            store_path: Directory containing the store.
+            select_cache_size: Maximum number of selections memoized by the project, see Project.select.
         """
-        annotations = annotation_info_from_xmi_zip(project_path)
-        source_files = source_files_from_xmi_zip(project_path)
-        return cls(annotations, source_files, project_path, 'xmi')
+        store = ProjectStore(store_path)
+        annotations = [(None, source_file, annotator) for source_file, annotator in store.documents]
+        return cls(annotations, store.source_files, store.catalogue.get('project_path'),
+                   store.catalogue.get('export_format'), store=store, select_cache_size=select_cache_size)
 
-    def __init__(self, annotations, source_files, project_path, export_format):
+    def __init__(self, annotations, source_files, project_path, export_format, cas_loader: CasLoader = None,
+                 annotation_cache: AnnotationCache = None, select_cache_size: int = 32, store: ProjectStore = None):
         self._annotation_info = pd.DataFrame(annotations, columns=['cas', 'source_file', 'annotator'])
+        self._cas_loader = cas_loader
+        self._store = store
+        self._remote = None
+        self._annotation_cache = annotation_cache
+        self._sentence_indices = WeakKeyDictionary()
+        self.select_cache = LRUCache(select_cache_size)
         self.path = project_path
         self.export_format = export_format
         self.layer_feature_separator = '>'
@@ -71,6 +151,10 @@ class Project:
     @property
     def typesystem(self):
         """Returns the Typesystem used by the CAS Objects in the Project."""
+        if self._store is not None:
+            return self._store.typesystem
+        if self._cas_loader is not None:
+            return self._cas_loader.typesystem
         return self._annotation_info.loc[0, 'cas'].typesystem
 
     @property
@@ -103,8 +187,20 @@ class Project:
 
     @property
     def cas_objects(self) -> List[cassis.Cas]:
-        """Returns a list with all CAS Objects in the project."""
-        return self._annotation_info['cas'].tolist()
+        """Returns a list with all CAS Objects in the project. For lazily loaded projects, this loads every CAS."""
+        return [self._cas(entry) for entry in self._annotation_info['cas']]
+
+    def _cas(self, entry) -> cassis.Cas:
+        # lazily loaded projects store the path of the annotation archive instead of the CAS
+        if self._store is not None:
+            raise RuntimeError('Projects opened from a store do not contain CAS objects.')
+        return entry if self._cas_loader is None else self._cas_loader(entry)
+
+    def _sentence_index(self, cas: cassis.Cas) -> SentenceIndex:
+        # indices are dropped together with their CAS, e.g. when it is evicted by the CasLoader
+        if cas not in self._sentence_indices:
+            self._sentence_indices[cas] = SentenceIndex(cas)
+        return self._sentence_indices[cas]
 
     def _unique_entries(self, info_type):
         return self._annotation_info[info_type].unique().tolist()
@@ -120,6 +216,98 @@ class Project:
 
         return df
 
+    def save_store(self, store_path, layers: List[str] = None) -> ProjectStore:
+        """
+        Writes the annotation tables of the project to a columnar store, which can be reopened with Project.open_store
+        without parsing any CAS. Every layer is stored with all of its features that have primitive values, i.e.
+        strings, booleans and numbers.
+
+        Args:
+            store_path: Directory to write the store to. Created if it does not exist.
+            layers: Names of the layers to store. If None, all annotation layers of the typesystem, i.e. subtypes of
+                uima.tcas.Annotation, except the builtin UIMA types are stored.
+        """
+        typesystem = self.typesystem
+        if layers is None:
+            layers = [layer_name for layer_name in self.layers if not layer_name.startswith('uima.')
+                      and typesystem.subsumes('uima.tcas.Annotation', layer_name)]
+
+        layer_features = []
+        for layer_name in map(extend_layer_name, layers):
+            features = {f.name: f for f in typesystem.get_type(layer_name).all_features}
+            layer_features.append((layer_name, None))
+            layer_features.extend((layer_name, feature_name) for feature_name in self.features(layer_name)
+                                  if typesystem.is_primitive(features[feature_name].rangeType))
+
+        tables = {}
+        for (layer_name, feature_name), frame in zip(layer_features, self._base_annotations(layer_features)):
+            if feature_name is None:
+                tables[layer_name] = (frame, {})
+            else:
+                tables[layer_name][1][feature_name] = frame['annotation']
+
+        documents = list(zip(self._annotation_info['source_file'], self._annotation_info['annotator']))
+        project_path = self.path if isinstance(self.path, str) else None
+        return ProjectStore.write(store_path, typesystem, documents, self.all_source_file_names, tables,
+                                  project_path=project_path, export_format=self.export_format)
+
+    def refresh(self) -> List[Tuple[str, str]]:
+        """
+        Updates a project loaded with Project.from_remote(..., max_connections=...) to the current state of the remote
+        project. Only annotation documents that changed since they were loaded are downloaded and parsed, see
+        RemoteLoader.refresh. Annotation tables memoized by Project.select are patched in place: rows of changed and
+        removed documents are replaced by the rows of the new documents. Views created before the refresh are not
+        updated.
+
+        Returns a sorted list of tuples (Source File Name, Annotator name) of all changed, added and removed annotation
+        documents.
+        """
+        if self._remote is None:
+            raise RuntimeError('Only projects loaded with Project.from_remote(..., max_connections=...) can be '
+                               'refreshed.')
+
+        remote = self._remote
+        loader = RemoteLoader(remote['remote_url'], remote['auth'], max_connections=remote['max_connections'])
+        try:
+            keys, changed, source_files, states = run_sync(
+                loader.refresh(remote['project'], remote['states'], remote['typesystem']))
+        finally:
+            loader.close()
+
+        loaded = {(source_file, annotator): cas for cas, source_file, annotator
+                  in self._annotation_info.itertuples(index=False, name=None)}
+        documents = set(changed) | (set(loaded) - set(keys))
+        remote['states'] = states
+        self.all_source_file_names = source_files
+
+        if documents:
+            self._annotation_info = pd.DataFrame([(changed.get(key, loaded.get(key)), *key) for key in keys],
+                                                 columns=['cas', 'source_file', 'annotator'])
+            changed_info = self._annotation_info[[key in changed for key in keys]]
+            self._patch_select_cache(documents, changed_info)
+
+        return sorted(documents)
+
+    def _patch_select_cache(self, documents, changed_info):
+        # unfiltered tables are patched, filtered tables are derived from them again
+        entries = [(key, self.select_cache.pop(key)) for key in self.select_cache.keys()]
+        base_keys = [key for key, _ in entries if len(key) == 2]
+        fresh = dict(zip(base_keys, self._annotations(changed_info, base_keys)))
+
+        patched = {}
+        for key, frame in entries:
+            if key in fresh:
+                index = frame.index
+                loaded = pd.MultiIndex.from_arrays([index.get_level_values('source_file'),
+                                                    index.get_level_values('annotator')])
+                patched[key] = concat_annotations([frame[~loaded.isin(list(documents))], fresh[key]])
+
+        for key, frame in entries:
+            if key in patched:
+                self.select_cache.put(key, patched[key])
+            elif key[:2] in patched:
+                self.select_cache.put(key, self._filter_annotations(patched[key[:2]], **dict(key[2:])))
+
     def feature_path(self, layer: str, feature:str):
         """Returns a path from the given layer and feature for passing to the Project.view method."""
         return construct_feature_path(layer, feature, self.layer_feature_separator)
@@ -133,17 +321,21 @@ class Project:
         """
         layer_name = extend_layer_name(layer_name)
         no_features = ['begin', 'end', 'sofa']
-        feature_names = (f.name for f in self.typesystem.get_type(layer_name).all_features if f.name not in no_features)
+        feature_names = [f.name for f in self.typesystem.get_type(layer_name).all_features if f.name not in no_features]
 
         if filter_empty:
-            feature_names = (name for name in feature_names if any(self.select(f'{layer_name}>{name}').annotations))
+            views = self.select_many([self.feature_path(layer_name, name) for name in feature_names])
+            feature_names = [name for name, view in zip(feature_names, views.values()) if any(view.annotations)]
 
-        return list(feature_names)
+        return feature_names
 
     def select(self,
                annotation: str,
                annotators: Union[str, List[str]] = None,
-               source_files: Union[str, List[str]] = None):
+               source_files: Union[str, List[str]] = None,
+               labels: Union[any, List[any]] = None,
+               span: Tuple[int, int] = None,
+               sentence_labels: Union[any, List[any]] = None):
         """
         Returns a View object, based on the specified selection parameters.
 
@@ -155,12 +347,153 @@ class Project:
                 None is provided, all annotators are included in the view.
             source_files: List of source files to be included. A single source file can be selected by passing a string.
                 If None is provided, all annotators are included in the view.
+            labels: List of labels to be included. Annotations with other labels are left out. A single label can be
+                selected by passing it directly. If None is provided, all labels are included.
+            span: Tuple (begin, end) of character offsets. Only annotations lying within these offsets are included.
+            sentence_labels: List of labels. Only annotations of sentences containing at least a single annotation
+                with any of these labels are included, see View.filter_sentences_by_labels. Evaluated before labels.
+
+        Selections are memoized in Project.select_cache, a LRUCache whose maxsize can be adjusted and whose statistics
+        are returned by Project.select_cache.info(). Setting the maxsize to 0 disables memoization. Filtered selections
+        are derived from the unfiltered selection of the same annotation, which is memoized as well, so that selecting
+        other annotators or source files does not traverse the CAS objects again. Lazily loaded projects only do so if
+        the unfiltered selection is held by the select cache or the annotation cache. Otherwise, only the CAS objects
+        of the selected annotators and source files are parsed and traversed, and the label, span and sentence filters
+        are applied during the traversal, so that excluded annotations are never added to a table. The same applies to
+        projects without memoization.
         """
-        layer_name, feature_name = self._layer_feature_split(annotation)
-        layer_name = extend_layer_name(layer_name)
-        info = self._filter_annotation_info(annotators, source_files)
-        annotations = self._annotations(info, layer_name, feature_name)
-        return View(annotations, self, layer_name, feature_name)
+        return self.select_many([annotation], annotators, source_files, labels, span, sentence_labels)[annotation]
+
+    def select_many(self,
+                    annotations: Sequence[str],
+                    annotators: Union[str, List[str]] = None,
+                    source_files: Union[str, List[str]] = None,
+                    labels: Union[any, List[any]] = None,
+                    span: Tuple[int, int] = None,
+                    sentence_labels: Union[any, List[any]] = None) -> Dict[str, 'View']:
+        """
+        Returns a dictionary mapping each of the given annotations to a View object, based on the specified selection
+        parameters. All Views are built in a single pass over the CAS objects of the project, which is considerably
+        faster than calling Project.select for each annotation.
+
+        Args:
+            annotations: Strings specifying the annotations to select (combination of layer and feature name). See
+                Project.select for details.
+            annotators: List of annotators to be included. A single annotator can be selected by passing a string. If
+                None is provided, all annotators are included in the views.
+            source_files: List of source files to be included. A single source file can be selected by passing a string.
+                If None is provided, all annotators are included in the views.
+            labels: List of labels to be included in every view. See Project.select for details.
+            span: Tuple (begin, end) of character offsets. See Project.select for details.
+            sentence_labels: List of labels selecting sentences. See Project.select for details.
+        """
+        layer_features = []
+        for annotation in annotations:
+            layer_name, feature_name = self._layer_feature_split(annotation)
+            layer_features.append((extend_layer_name(layer_name), feature_name))
+
+        filters = dict(annotators=annotators, source_files=source_files, labels=labels, span=span,
+                       sentence_labels=sentence_labels)
+        selection = tuple((name, tuple(value) if name == 'span' else self._selection_key(value))
+                          for name, value in filters.items() if value is not None)
+        keys = [(*layer_feature, *selection) for layer_feature in layer_features]
+        frames = [self.select_cache.get(key) for key in keys]
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+
+        if missing:
+            missing_layer_features = [layer_features[i] for i in missing]
+            for i, frame in zip(missing, self._select_annotations(missing_layer_features, **filters)):
+                self.select_cache.put(keys[i], frame)
+                frames[i] = frame
+
+        return {annotation: View(frame, self, layer_name, feature_name)
+                for annotation, frame, (layer_name, feature_name) in zip(annotations, frames, layer_features)}
+
+    @staticmethod
+    def _selection_key(selection):
+        return frozenset(ensure_list(selection))
+
+    def _select_annotations(self, layer_features, annotators=None, source_files=None, **predicates):
+        filtered = bool(annotators or source_files) or any(value is not None for value in predicates.values())
+        if not filtered:
+            return self._base_annotations(layer_features)
+
+        # projects holding all CAS objects in memory derive filtered tables from the memoized unfiltered ones, so that
+        # changing the filters does not traverse the CAS objects again
+        if self._cas_loader is None and self._store is None and self.select_cache.maxsize:
+            return [self._filter_annotations(frame, annotators, source_files, **predicates)
+                    for frame in self._base_annotations(layer_features)]
+
+        # lazily loaded projects derive filtered tables from unfiltered tables only if these are at hand, otherwise
+        # only the selected documents are parsed and traversed, with the remaining filters applied during the traversal
+        frames = [self._cached_base_annotations(layer_feature) for layer_feature in layer_features]
+        frames = [None if frame is None else self._filter_annotations(frame, annotators, source_files, **predicates)
+                  for frame in frames]
+
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+        if missing:
+            info = self._filter_annotation_info(annotators, source_files)
+            missing_layer_features = [layer_features[i] for i in missing]
+            for i, frame in zip(missing, self._annotations(info, missing_layer_features, **predicates)):
+                frames[i] = frame
+        return frames
+
+    def _cached_base_annotations(self, layer_feature):
+        # unfiltered annotation table from the select cache or the annotation cache, None if neither holds it
+        frame = self.select_cache.get(layer_feature)
+        if frame is None and self._annotation_cache is not None:
+            frame = self._annotation_cache.load(*layer_feature)
+            if frame is not None:
+                self.select_cache.put(layer_feature, frame)
+        return frame
+
+    def _base_annotations(self, layer_features):
+        # unfiltered annotation tables, from the select cache, the annotation cache or extracted from the CAS objects
+        keys = list(layer_features)
+        frames = [self.select_cache.get(key) for key in keys]
+
+        if self._annotation_cache is not None:
+            frames = [self._annotation_cache.load(*layer_feature) if frame is None else frame
+                      for frame, layer_feature in zip(frames, layer_features)]
+
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+        if missing:
+            missing_layer_features = [layer_features[i] for i in missing]
+            for i, frame in zip(missing, self._annotations(self._annotation_info, missing_layer_features)):
+                if self._annotation_cache is not None:
+                    self._annotation_cache.store(frame, *layer_features[i])
+                frames[i] = frame
+
+        for key, frame in zip(keys, frames):
+            self.select_cache.put(key, frame)
+
+        return frames
+
+    @staticmethod
+    def _filter_annotations(annotations, annotators=None, source_files=None, labels=None, span=None,
+                            sentence_labels=None):
+        mask = np.ones(len(annotations), dtype=bool)
+
+        if annotators:
+            mask &= annotations.index.get_level_values('annotator').isin(ensure_list(annotators))
+
+        if source_files:
+            mask &= annotations.index.get_level_values('source_file').isin(ensure_list(source_files))
+
+        if span is not None:
+            begin, end = span
+            mask &= annotations.index.get_level_values('begin') >= begin
+            mask &= annotations.index.get_level_values('end') <= end
+
+        if sentence_labels is not None:
+            candidates = annotations[mask]
+            sentences = candidates.index.get_level_values('sentence')
+            mask[mask] = sentence_label_mask(sentences, candidates['annotation'], ensure_list(sentence_labels))
+
+        if labels is not None:
+            mask &= label_mask(annotations['annotation'], ensure_list(labels))
+
+        return annotations[mask]
 
     def _layer_feature_split(self, layer_feature_string):
         split = layer_feature_string.rsplit(self.layer_feature_separator, 1)
@@ -169,62 +502,101 @@ class Project:
         else:
             return split[0], None
 
-    def _annotations(self, annotation_info, layer_name, feature_name):
-        entries = []
+    def _annotations(self, annotation_info, layer_features, labels=None, span=None, sentence_labels=None):
+        if self._store is not None:
+            documents = list(zip(annotation_info['source_file'], annotation_info['annotator']))
+            frames = [self._store.load(layer_name, feature_name, documents) for layer_name, feature_name in layer_features]
+            if labels is None and span is None and sentence_labels is None:
+                return frames
+            return [self._filter_annotations(frame, labels=labels, span=span, sentence_labels=sentence_labels)
+                    for frame in frames]
+
+        # each layer is traversed once, its features share sentence ids and texts
+        layer_names = list(dict.fromkeys(layer_name for layer_name, _ in layer_features))
+        entries = {layer_name: [] for layer_name in layer_names}
+        feature_structures = {layer_name: [] for layer_name in layer_names}
+
         for cas, source_file, annotator in annotation_info.itertuples(index=False, name=None):
-            for sentence in cas.select(SENTENCE_TYPE_NAME):
-                try:
-                    for annotation in cas.select_covered(layer_name, sentence):
-                        sentence_id = f'{source_file}_{sentence.begin}-{sentence.end}'
-                        entry = (annotation,
-                                 annotation.get_covered_text(),
-                                 source_file,
-                                 sentence_id,
-                                 sentence.get_covered_text(),
-                                 annotation.begin,
-                                 annotation.end,
-                                 annotator)
-                        entries.append(entry)
-                except cassis.typesystem.TypeNotFoundError:
-                    continue
-        columns = ['_annotation', 'text', 'source_file', 'sentence', '_sentence_text', 'begin', 'end', 'annotator']
-        index = ['source_file', 'sentence', 'begin', 'end', 'annotator']
-        annotations = pd.DataFrame(entries, columns=columns).set_index(index)
-
-        if feature_name is not None:
-            annotations['annotation'] = annotations['_annotation'].map(lambda x: x.get(feature_name), na_action='ignore')
-
-            # convert java boolean strings into booleans
-            dtype = get_dtype(self.typesystem, layer_name, feature_name)
-            if dtype == 'bool':
-                annotations['annotation'] = annotations['annotation'].map(lambda x: x.startswith('t'), na_action='ignore')
+            index = self._sentence_index(self._cas(cas))
+            sentence_ids = [f'{source_file}_{sentence.begin}-{sentence.end}' for sentence in index.sentences]
+
+            for layer_name in layer_names:
+                covered = index.covered(layer_name)
+                for sentence_id, sentence_text, annotations in zip(sentence_ids, index.sentence_texts, covered):
+                    if span is not None:
+                        annotations = [a for a in annotations if a.begin >= span[0] and a.end <= span[1]]
+                    feature_structures[layer_name].extend(annotations)
+                    entries[layer_name].extend([(source_file, sentence_id, sentence_text, annotator)] * len(annotations))
+
+        frames = []
+        for layer_name, feature_name in layer_features:
+            layer_feature_structures = feature_structures[layer_name]
+            texts = [annotation.get_covered_text() for annotation in layer_feature_structures]
+            values = texts if feature_name is None else \
+                self._feature_values(layer_feature_structures, layer_name, feature_name)
+
+            keep = np.ones(len(values), dtype=bool)
+            if sentence_labels is not None:
+                sentences = [entry[1] for entry in entries[layer_name]]
+                keep &= sentence_label_mask(sentences, values, ensure_list(sentence_labels))
+            if labels is not None:
+                keep &= label_mask(values, ensure_list(labels))
+            kept = np.flatnonzero(keep)
+
+            # texts are stored as categoricals, holding every distinct text only once
+            source_files, sentences, sentence_texts, annotators = zip(*[entries[layer_name][i] for i in kept]) \
+                if len(kept) else ([], [], [], [])
+            annotations = pd.DataFrame({
+                'text': pd.Categorical([texts[i] for i in kept]),
+                'source_file': pd.Series(source_files, dtype=object),
+                'sentence': pd.Series(sentences, dtype=object),
+                '_sentence_text': pd.Categorical(sentence_texts),
+                'begin': pd.Series([layer_feature_structures[i].begin for i in kept], dtype=np.int64),
+                'end': pd.Series([layer_feature_structures[i].end for i in kept], dtype=np.int64),
+                'annotator': pd.Series(annotators, dtype=object),
+            }).set_index(['source_file', 'sentence', 'begin', 'end', 'annotator'])
+
+            if feature_name is None:
+                annotations['annotation'] = annotations['text']
+            else:
+                annotations['annotation'] = pd.Categorical([values[i] for i in kept])
 
-        else:
-            annotations['annotation'] = annotations['text']
+            frames.append(annotations)
+
+        return frames
+
+    def _feature_values(self, feature_structures, layer_name, feature_name):
+        values = [fs.get(feature_name) for fs in feature_structures]
+
+        # convert java boolean strings into booleans
+        dtype = get_dtype(self.typesystem, layer_name, feature_name)
+        if dtype == 'bool':
+            values = [value if value is None else value.startswith('t') for value in values]
 
         # map None value to 'None' String
         # TODO check side effects of this
-        annotations['annotation'].replace(to_replace=[None], value='None', inplace=True)
-
-        return annotations
+        return ['None' if value is None else value for value in values]
 
 
 class View:
     _pairwise_iaa_measures = {
-        'kappa': cohen_kappa_score,
-        'percentage': percentage_agreement
+        'kappa': kappa_from_agreement,
+        'percentage': percentage_from_agreement
     }
 
     _aggregate_iaa_measures = {
-        'krippendorff': alpha,
+        'krippendorff': krippendorff_alpha,
         'gamma': gamma_agreement
     }
 
+    _consolidation_methods = ['majority vote', 'dawid-skene']
+
     def __init__(self, annotations: pd.DataFrame, project: Project, layer_name: str, feature_name: str = None):
         self._annotation_dataframe = annotations
         self.project = project
         self.layer_name = layer_name
         self.feature_name = feature_name
+        self._count_cube = None
 
     @property
     def level(self):
@@ -234,17 +606,17 @@ class View:
     @property
     def annotations(self) -> pd.Series:
         """Returns a Series of all annotations in the view."""
-        return self._annotation_dataframe['annotation']
+        return decode_categoricals(self._annotation_dataframe['annotation'])
 
     @property
     def texts(self) -> pd.Series:
         """Returns a Series of all texts covered by annotations in the view."""
-        return self._annotation_dataframe['text']
+        return decode_categoricals(self._annotation_dataframe['text'])
 
     @property
     def annotators(self) -> List[str]:
-        """Returns a list containing all annotators in the view."""
-        return self.data_frame['annotator'].unique().tolist()
+        """Returns a list containing all annotators in the view, in order of appearance."""
+        return self._annotation_dataframe.index.get_level_values('annotator').unique().tolist()
 
     @property
     def labels(self) -> List[any]:
@@ -261,60 +633,35 @@ class View:
     @property
     def data_frame(self) -> pd.DataFrame:
         """Returns a DataFrame with annotation information."""
-        return self._annotation_dataframe.reset_index()
+        return decode_categoricals(self._annotation_dataframe.reset_index())
 
     @property
     def document_annotator_matrix(self) -> pd.DataFrame:
         """Returns a Dataframe with document names as indices and annotator names als """
         # TODO: handle more elegantly, annotations are lost by dropping duplicates
-        return self._annotation_dataframe.loc[~self._annotation_dataframe.index.duplicated(), 'annotation'].unstack()
+        annotations = self.annotations
+        return annotations[~annotations.index.duplicated()].unstack()
 
-    def confusion_matrices(self, only_differences=False, aggregate=None) -> Union[pd.Series, pd.DataFrame]:
-        """Returns a Series containing pairwise confusion matrices for every combination of annotators in the View."""
-        if len(self.annotators) < 2:
-            return pd.Series(dtype='object')
+    def confusion_matrices(self, only_differences=False, aggregate=None,
+                           alignment: str = 'exact') -> Union[pd.Series, pd.DataFrame]:
+        """
+        Returns a Series containing pairwise confusion matrices for every pair of annotators in the View that shares
+        at least one unit, see View.overlap_graph.
 
-        pairs = [list(pair) for pair in combinations(self.annotators, 2)]
-        labels = self.labels
+        Args:
+            only_differences: If set to true, agreements (the diagonals of the matrices) are set to 0.
+            aggregate: If set to 'by_annotator', returns a Series containing a matrix per annotator that sums the
+                annotator's confusions with all other annotators. If set to 'total', returns the sum of all pairwise
+                matrices. If None (default), the pairwise matrices are returned.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        annotators = self.annotators
+        if len(annotators) < 2:
+            return pd.Series(dtype='object')
 
-        M = self.document_annotator_matrix
-        if all(type(label) == bool for label in labels):
-            M = M.replace(self.label2id)
-
-        entries = []
-        for pair in pairs:
-            a, b = pair
-            cm = confusion_matrix(M, pair, labels)
-            cm_df = pd.DataFrame(cm, index=labels, columns=labels).rename_axis(index=a, columns=b)
-
-            if only_differences:
-                cm_df = zero_diag_cm_df(cm_df)
-
-            entries.append((a, b, cm_df))
-
-        index = ['a', 'b']
-        name = 'confusion_matrix'
-        cms = pd.DataFrame(entries, columns=[*index, name]).set_index(index)[name]
-
-        if aggregate == 'by_annotator':
-            cms = cms.to_frame().reset_index()
-            by_anno = []
-            for annotator in self.annotators:
-                a_confs = cms.query('a == @annotator').set_index(['a', 'b'])
-                b_confs = cms.query('b == @annotator').set_index(['b', 'a']).apply(lambda x: x.T)
-                total = np.sum(a_confs.append(b_confs))[0]
-                total.index.rename(annotator, inplace=True)
-                total.columns.rename('others', inplace=True)
-                by_anno.append(total)
-            return pd.Series(data=by_anno, index=self.annotators)
-
-        if aggregate == 'total':
-            total = np.sum(cms) if len(cms) > 1 else cms[0]
-            total.index.rename(None, inplace=True)
-            total.columns.rename(None, inplace=True)
-            return total
-
-        return cms
+        return confusion_matrices_from_pairs(*self._pairwise_confusions(alignment), annotators, self.labels,
+                                             only_differences, aggregate)
 
     def consolidated_annotations(self, levels=['sentence'], additional_columns=[], method='majority vote'):
         """
@@ -328,12 +675,37 @@ class View:
                 annotation per sentence (e.g. token-level annotations), ['sentence', 'begin', 'end'] should be used.
             additional_columns: Other columns to be included in the output. Defaults to [], returning only annotation
                 labels.
-            method: Consolidation method to use, defaults to 'majority vote' (no other method is currently implemented).
+            method: Consolidation method to use, either 'majority vote' (default) or 'dawid-skene'. Majority vote picks
+                the most frequent label, breaking ties in favour of the label annotated first. 'dawid-skene' picks the
+                most probable label according to the EM estimate of Dawid and Skene, which weighs annotators by their
+                estimated reliability.
         """
+        if method not in self._consolidation_methods:
+            raise ValueError(f'Unknown consolidation method "{method}". '
+                             f'Valid methods are {list(self._consolidation_methods)}.')
+
         additional_columns = [col for col in additional_columns if col not in levels]  # filter intersecting columns
 
         df = self.data_frame
-        consolidated = df.groupby(levels)[['annotation']].agg(lambda x: x.value_counts().index[0])
+        level_names = [levels] if isinstance(levels, str) else list(levels)
+        keys = df[level_names[0]] if len(level_names) == 1 else pd.MultiIndex.from_frame(df[level_names])
+        units, index = keys.factorize(sort=True)
+        index = index.set_names(level_names)
+
+        labels = self.labels
+        codes = pd.Categorical(df['annotation'], categories=labels).codes.astype(np.int64)
+        if method == 'dawid-skene':
+            annotators = pd.factorize(df['annotator'], sort=True)[0]
+            posteriors = dawid_skene(units, annotators, codes, len(index), len(labels))
+            consolidated = np.where(np.bincount(units[codes >= 0], minlength=len(index)) > 0,
+                                    posteriors.argmax(axis=1), -1)
+        else:
+            consolidated = majority_vote(units, codes, len(index))
+
+        annotated = consolidated >= 0
+        consolidated = pd.DataFrame({'annotation': np.asarray(labels, dtype=object)[consolidated[annotated]]},
+                                    index=index[annotated])
+        consolidated['annotation'] = consolidated['annotation'].infer_objects()
 
         if additional_columns:
             consolidated = consolidated.join(df.set_index(levels)[additional_columns].drop_duplicates())
@@ -343,10 +715,8 @@ class View:
     # TODO: Unify filtering functions
     def filter_labels(self, labels: List[str] = None, include=True):
         """Returns a View of the current annotations, filtered by the given list of labels."""
-
-        op = '==' if include else '!='
-        annotations = self._annotation_dataframe.query(f'annotation {op} @labels')
-        return View(annotations, self.project, self.layer_name, self.feature_name)
+        mask = label_mask(self._annotation_dataframe['annotation'], ensure_list(labels) or [], include)
+        return View(self._annotation_dataframe[mask], self.project, self.layer_name, self.feature_name)
 
     def filter_sentences_by_labels(self, labels: List[str] = None, include=True):
         """
@@ -354,73 +724,89 @@ class View:
         containing any of the given labels. Note that annotations with other labels will be included in the list of
         annotations.
         """
+        sentences = self._annotation_dataframe.index.get_level_values('sentence')
+        mask = sentence_label_mask(sentences, self._annotation_dataframe['annotation'], ensure_list(labels) or [],
+                                   include)
+        return View(self._annotation_dataframe[mask], self.project, self.layer_name, self.feature_name)
 
-        def filter_fn(sentence):
-            return np.any(np.isin(labels, sentence['annotation'].unique(), invert=not include))
-
-        annotations = self._annotation_dataframe.groupby('sentence').filter(filter_fn)
-
-        return View(annotations, self.project, self.layer_name, self.feature_name)
-
-    def value_counts(self, grouped_by: Union[str, Sequence[str]] = None) -> pd.Series:
+    @property
+    def count_cube(self) -> CountCube:
+        """
+        Returns a CountCube holding the number of annotations per annotator, source file and label in the view. Source
+        files of the project without annotations are included. The cube is built once per view.
+        """
+        if self._count_cube is None:
+            self._count_cube = CountCube.from_annotations(self._annotation_dataframe, self.labels,
+                                                          self.project.all_source_file_names)
+        return self._count_cube
+
+    def value_counts(self,
+                     grouped_by: Union[str, Sequence[str]] = None,
+                     annotators: Union[str, List[str]] = None,
+                     source_files: Union[str, List[str]] = None) -> pd.Series:
         """
         Returns a Series containing value counts of the feature included in the view.
 
         Args:
             grouped_by: Name of the variable to group the counts by, either "annotator", "source_file" or a list
                 containing both. If a list is given, the order of the variables determines the nesting order.
+            annotators: List of annotators to count. If None, all annotators in the view are counted.
+            source_files: List of source files to count. If None, all source files in the view are counted.
         """
-        annotations = self._annotation_dataframe
+        if set(ensure_list(grouped_by) or []).issubset(CountCube.axes[:2]):
+            cube = self.count_cube.subset(ensure_list(annotators), ensure_list(source_files))
+            return cube.value_counts(grouped_by)
+
+        annotations = self._subset(annotators, source_files).annotations
         if grouped_by is not None:
-            annotations = self._annotation_dataframe.groupby(grouped_by)
-        return annotations['annotation'].value_counts()
+            annotations = annotations.groupby(grouped_by)
+        return annotations.value_counts()
 
-    def count(self, grouped_by=None, include_empty_files=False):
+    def count(self,
+              grouped_by: Union[str, Sequence[str]] = None,
+              include_empty_files: bool = False,
+              annotators: Union[str, List[str]] = None,
+              source_files: Union[str, List[str]] = None):
         """
         Returns a Series containing number of annotations included in the view.
 
         Args:
-            grouped_by: Name of the variable to group the counts by, either "annotator", "source_file" or a list
-                containing both. If a list is given, the order of the variables determines the nesting order.
-            include_empty_files: If True, empty files will be included in the output. Ignored when grouped_by is None.
+            grouped_by: Name of the variable to group the counts by, either "annotator", "source_file", "annotation"
+                or a list containing several of them. If a list is given, the order of the variables determines the
+                nesting order.
+            include_empty_files: If True, all combinations of the grouping variables are included, with a count of 0
+                if there are no annotations, including source files of the project without any annotations. Ignored
+                when grouped_by is None.
+            annotators: List of annotators to count. If None, all annotators in the view are counted.
+            source_files: List of source files to count. If None, all source files in the view are counted, or all
+                source files of the project if include_empty_files is True.
         """
-        annotations = self._annotation_dataframe.copy()\
-            .drop(columns=['_annotation', '_sentence_text', 'text'])\
-            .droplevel('sentence')
+        if grouped_by is None:
+            return self._subset(annotators, source_files)._annotation_dataframe['annotation'].count()
 
-        if include_empty_files and grouped_by:
-            annotators = annotations.reset_index()['annotator'].unique()
-            unannotated_files = self.project.all_source_file_names
-            dummy_entries = []
+        if set(ensure_list(grouped_by)).issubset(CountCube.axes):
+            if source_files is None and not include_empty_files:
+                source_files = self._annotation_dataframe.index.get_level_values('source_file').unique()
+            cube = self.count_cube.subset(ensure_list(annotators), ensure_list(source_files))
+            return cube.total(grouped_by, include_zeros=include_empty_files)
 
-            for annotator in annotators:
-                for file in unannotated_files:
-                    dummy_entries.append((file, -1, -1, annotator, 'NA'))
-
-            annotations = pd.DataFrame(dummy_entries, columns=annotations.reset_index().columns)\
-                .set_index(annotations.index.names)\
-                .append(annotations)
-
-        if grouped_by is not None:
-            annotations = annotations.groupby(grouped_by)
+        annotations = self._subset(annotators, source_files)._annotation_dataframe
+        return annotations.groupby(grouped_by)['annotation'].count()
 
-        counts = annotations['annotation'].count()
-
-        if include_empty_files and grouped_by:
-            if isinstance(grouped_by, str) or len(grouped_by) == 1:
-                overcount = len(annotators)  # 1 grouping level
-            else:
-                overcount = 1  # 2 grouping levels
-            counts -= overcount
-
-        return counts
+    def _subset(self, annotators, source_files) -> 'View':
+        annotations = self.project._filter_annotations(self._annotation_dataframe, annotators, source_files)
+        return View(annotations, self.project, self.layer_name, self.feature_name)
 
-    def iaa_pairwise(self, measure='kappa', level='nominal') -> pd.DataFrame:
+    def iaa_pairwise(self, measure='kappa', level='nominal', alignment: str = 'exact') -> pd.DataFrame:
         """
-        Returns a Series of pairwise inter-annotator agreement scores between all annotators.
+        Returns a DataFrame of pairwise inter-annotator agreement scores and the number of shared units n for every
+        pair of annotators sharing at least one unit. Pairs without shared units are omitted, see View.overlap_graph.
 
         Args:
             measure: Name of the measure to use, either 'kappa' (default), 'percentage'.
+            level: Variable scale of the annotations. Pairwise measures treat all labels as nominal.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
         """
         if measure in self._pairwise_iaa_measures:
             agreement_fn = self._pairwise_iaa_measures.get(measure)
@@ -431,26 +817,125 @@ class View:
         if len(annotators) < 2:
             return pd.DataFrame([])
 
-        M = self.document_annotator_matrix
-
-        entries = []
-        for a, b in combinations(annotators, 2):
-            data = M[[a, b]].dropna()
-            n = len(data)
+        a, b, confusions = self._pairwise_confusions(alignment)
+        n, observed, expected = agreement_from_confusions(confusions)
+        scores = agreement_fn(observed, expected)
 
-            if level == 'nominal':
-                data.replace(self.label2id, inplace=True)
-
-            score = agreement_fn(data[a], data[b])
-            entries.append((a, b, n, score))
-
-        return pd.DataFrame(entries, columns=['a', 'b', 'n', measure]).set_index(['a', 'b'])
+        index = pd.MultiIndex.from_arrays([np.take(annotators, a), np.take(annotators, b)], names=['a', 'b'])
+        return pd.DataFrame({'n': n, measure: scores}, index=index)
 
     def pairwise_kappa(self):
         """Returns a Series of pairwise kappa scores between all annotators."""
         return self.iaa_pairwise(measure='kappa', level='nominal')
 
-    def iaa(self, measure='krippendorff', level='nominal') -> float:
+    def iter_gamma(self, workers: int = None, timeout: float = None):
+        """
+        Calculates gamma agreement for every sentence of the view, yielding a GammaResult (unit, gamma, error) per
+        sentence as soon as it is available. Sentences for which gamma cannot be calculated are yielded with a NaN
+        gamma and a description of the error. Useful for reporting progress of long computations.
+
+        Args:
+            workers: Number of processes used for the calculation. If set, results are yielded in order of completion.
+            timeout: Maximum number of seconds spent on a single sentence.
+        """
+        return iter_gamma_agreement(self._annotation_dataframe.reset_index(), workers=workers, timeout=timeout)
+
+    def aligned_units(self, alignment: str = 'overlap') -> pd.Series:
+        """
+        Returns a Series assigning a unit id to every annotation of the view. Annotations of different annotators with
+        the same unit id are compared by agreement measures.
+
+        Args:
+            alignment: Either 'exact', aligning annotations with identical offsets, or 'overlap' (default), aligning
+                overlapping annotations of different annotators within a source file, see utils.align_spans. With
+                'exact' alignment, additional annotations of an annotator with identical offsets are dropped.
+        """
+        index = self._annotation_dataframe.index
+        return pd.Series(self._align(index, alignment), index=index, name='unit')
+
+    @staticmethod
+    def _align(index, alignment):
+        if alignment == 'exact':
+            units = exact_units(index)
+        elif alignment == 'overlap':
+            units = align_spans(index.get_level_values('source_file'), index.get_level_values('begin').values,
+                                index.get_level_values('end').values, index.get_level_values('annotator'))
+        else:
+            raise ValueError(f'"alignment" must be one of {["exact", "overlap"]}, but was "{alignment}"!')
+        return units
+
+    def agreement_statistics(self, alignment: str = 'exact') -> AgreementStatistics:
+        """
+        Returns an AgreementStatistics object holding sufficient statistics of the agreement in the view. Annotations
+        can be added to and removed from it, e.g. when an annotator finishes another document, without recomputing
+        the statistics of the whole view.
+
+        Args:
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units. With 'exact' alignment, units are tuples (source_file, sentence,
+                begin, end), with 'overlap' alignment tuples (source_file, unit id).
+        """
+        annotations = self._annotation_dataframe['annotation'].dropna()
+        index = annotations.index
+        if alignment == 'exact':
+            units = index.droplevel('annotator')
+        else:
+            unit_ids = self.aligned_units(alignment).values[self._annotation_dataframe['annotation'].notna().values]
+            units = pd.MultiIndex.from_arrays([index.get_level_values('source_file'), unit_ids])
+        return AgreementStatistics.from_annotations(units, index.get_level_values('annotator'), annotations.values)
+
+    def _unit_label_codes(self, alignment='exact'):
+        # long format equivalent of the document annotator matrix: a unit id and a label id per annotation
+        units, _, codes = self._annotator_unit_codes(alignment)
+        return units, codes, self.labels
+
+    def _annotator_unit_codes(self, alignment='exact'):
+        # long format: a unit id, an annotator id (as in View.annotators) and a label id per annotation
+        units = self.aligned_units(alignment).values
+        annotators = pd.Categorical(self._annotation_dataframe.index.get_level_values('annotator'),
+                                    categories=self.annotators).codes.astype(np.int64)
+        codes = pd.Categorical(self._annotation_dataframe['annotation'].values, categories=self.labels).codes
+        aligned = units >= 0
+        return units[aligned], annotators[aligned], codes[aligned].astype(np.int64)
+
+    def _pairwise_confusions(self, alignment='exact'):
+        units, annotators, codes = self._annotator_unit_codes(alignment)
+        return pairwise_confusions(units, annotators, codes, len(self.annotators), len(self.labels))
+
+    def annotator_units(self, alignment: str = 'exact') -> Dict[str, np.ndarray]:
+        """
+        Returns an inverted index mapping every annotator to the sorted ids of the units they annotated.
+
+        Args:
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        units, annotators, _ = self._annotator_unit_codes(alignment)
+        unit_ids, offsets = annotator_unit_index(units, annotators, len(self.annotators))
+        return {annotator: unit_ids[offsets[i]:offsets[i + 1]] for i, annotator in enumerate(self.annotators)}
+
+    def overlap_graph(self, alignment: str = 'exact') -> pd.Series:
+        """
+        Returns a Series counting the units shared by every pair of annotators with at least one shared unit, i.e. the
+        edges of the overlap graph of the annotators. Pairwise agreement and confusion matrices are only calculated for
+        these pairs. Useful to check the coverage of an annotator assignment.
+
+        Args:
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        units, annotators, codes = self._annotator_unit_codes(alignment)
+        labelled = codes >= 0
+        units, annotators = units[labelled], annotators[labelled]
+        first, second = annotator_pairs(units, annotators)
+
+        n_annotators = len(self.annotators)
+        pairs, n = np.unique(annotators[first] * n_annotators + annotators[second], return_counts=True)
+        a, b = np.take(self.annotators, pairs // n_annotators), np.take(self.annotators, pairs % n_annotators)
+        return pd.Series(n, index=pd.MultiIndex.from_arrays([a, b], names=['a', 'b']), name='n', dtype=np.int64)
+
+    def iaa(self, measure='krippendorff', level='nominal', workers: int = None, timeout: float = None,
+            alignment: str = 'exact') -> float:
         """
         Returns inter-annotator agreement for the view.
 
@@ -458,26 +943,299 @@ class View:
             measure: Name of the measure to use, either 'krippendorff' for Krippendorff's Alpha (default) or 'kappa',
                 for average pairwise Cohen's Kappa score.
             level: Variable scale to use, when calculating Krippendorff's Alpha. Valid values are 'nominal' (default),
-                'ordinal' and 'interval'.
+                'ordinal', 'interval' and 'ratio'. Labels are ordered as in View.labels.
+            workers: Number of processes used to calculate the 'gamma' measure. Ignored for other measures.
+            timeout: Maximum number of seconds spent on a single sentence when calculating the 'gamma' measure.
+                Sentences exceeding it are skipped. Ignored for other measures.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units. Ignored for the 'gamma' measure, which aligns annotations itself.
         """
-        M = self.document_annotator_matrix
-
         if measure in self._aggregate_iaa_measures:
             agreement_fn = self._aggregate_iaa_measures[measure]
 
             if measure == 'krippendorff':
-                if level == 'nominal':
-                    category_to_index = {category: i for i, category in enumerate(self.labels)}
-                    M.replace(category_to_index, inplace=True)
-                    return agreement_fn(M.values.T, level_of_measurement=level)
+                units, codes, labels = self._unit_label_codes(alignment)
+                return agreement_fn(units, codes, labels, level=level)
 
             if measure == 'gamma':
                 M = self._annotation_dataframe.reset_index()
-                return agreement_fn(M)
+                return agreement_fn(M, workers=workers, timeout=timeout)
 
         if measure in self._pairwise_iaa_measures:
-            scores = self.iaa_pairwise(measure)
+            scores = self.iaa_pairwise(measure, alignment=alignment)
             return np.average(scores[measure], weights=scores['n'])
 
         possible_measures = list(self._aggregate_iaa_measures.keys()) + list(self._pairwise_iaa_measures.keys())
-        raise ValueError(f'"measure" must be one of {possible_measures}, but was "{measure}"!')
\ No newline at end of file
+        raise ValueError(f'"measure" must be one of {possible_measures}, but was "{measure}"!')
+
+    def iaa_by_label(self, measure='krippendorff', workers: int = None, timeout: float = None,
+                     alignment: str = 'exact') -> pd.Series:
+        """
+        Returns a Series containing inter-annotator agreement for every label of the view, calculated in a single pass
+        over the annotations.
+
+        For 'krippendorff', 'kappa' and 'percentage', every label is treated as a binary category against all other
+        labels (one-vs-rest), computed from the coincidence matrix or the pairwise confusion matrices of all labels.
+        Pairwise scores are averaged weighted by the number of shared units, skipping pairs for which a label's score is
+        undefined, e.g. Kappa for pairs in which neither annotator used the label.
+        For 'gamma', agreement on a label is calculated from the continua of the annotations with that label only, like
+        View.filter_labels(label).iaa('gamma'), but sentences are collected once for all labels.
+
+        Args:
+            measure: Name of the measure to use, either 'krippendorff' (default), 'kappa', 'percentage' or 'gamma'.
+            workers: Number of processes used to calculate the 'gamma' measure. Ignored for other measures.
+            timeout: Maximum number of seconds spent on a single label of a sentence when calculating the 'gamma'
+                measure. Ignored for other measures.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units. Ignored for the 'gamma' measure.
+        """
+        labels = self.labels
+        if measure == 'gamma':
+            scores = gamma_agreement_by_label(self._annotation_dataframe.reset_index(), workers, timeout)
+            scores = scores.reindex(labels).values
+        elif measure == 'krippendorff':
+            units, codes, _ = self._unit_label_codes(alignment)
+            labelled = codes >= 0
+            scores = one_vs_rest_alpha(coincidence_matrix(units[labelled], codes[labelled], len(labels)))
+        elif measure in self._pairwise_iaa_measures:
+            _, _, confusions = self._pairwise_confusions(alignment)
+            n, observed, expected = one_vs_rest_agreement(confusions)
+            pair_scores = self._pairwise_iaa_measures[measure](observed, expected)
+            weights = np.where(np.isnan(pair_scores), 0, n[:, None])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.nansum(weights * pair_scores, axis=0) / weights.sum(axis=0)
+        else:
+            possible_measures = list(self._aggregate_iaa_measures.keys()) + list(self._pairwise_iaa_measures.keys())
+            raise ValueError(f'"measure" must be one of {possible_measures}, but was "{measure}"!')
+
+        return pd.Series(scores, index=pd.Index(labels, name='annotation'), name=measure, dtype=np.float64)
+
+    def iaa_confidence_interval(self, measure='krippendorff', level='nominal', confidence: float = 0.95,
+                                n_replicates: int = 1000, seed: int = None, workers: int = None,
+                                alignment: str = 'exact') -> pd.Series:
+        """
+        Returns a Series containing the estimate of View.iaa and the bounds of its bootstrap percentile confidence
+        interval. Replicates resample the units of the view with replacement and are evaluated in batches.
+
+        Args:
+            measure: Name of the measure to use, either 'krippendorff' (default), 'kappa' or 'percentage'.
+            level: Variable scale to use, when calculating Krippendorff's Alpha, see View.iaa.
+            confidence: Confidence level of the interval, defaults to 0.95.
+            n_replicates: Number of bootstrap replicates, defaults to 1000.
+            seed: Seed for reproducible intervals.
+            workers: Number of processes evaluating chunks of replicates.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        if measure == 'krippendorff':
+            units, codes, labels = self._unit_label_codes(alignment)
+            labelled = codes >= 0
+            unit_ids, units = np.unique(units[labelled], return_inverse=True)
+            entry_units, cells, values = coincidence_entries(units, codes[labelled], len(labels))
+            statistic = partial(alpha_replicates, entry_units=entry_units, cells=cells, values=values, labels=labels,
+                                level=level)
+            chunk_size = bootstrap_chunk_size(len(unit_ids), len(cells), len(labels) ** 2)
+            replicates = bootstrap(statistic, len(unit_ids), n_replicates, seed, workers, chunk_size)
+        elif measure in self._pairwise_iaa_measures:
+            unit_ids, pairs = self._pairwise_bootstrap(measure, n_replicates, seed, workers, alignment)
+            replicates = self._pooled_pairwise(pairs)
+        else:
+            possible_measures = ['krippendorff'] + list(self._pairwise_iaa_measures.keys())
+            raise ValueError(f'"measure" must be one of {possible_measures}, but was "{measure}"!')
+
+        lower, upper = self._percentiles(replicates, confidence)
+        return pd.Series({'estimate': self.iaa(measure, level, alignment=alignment), 'lower': lower, 'upper': upper},
+                         name=measure)
+
+    def iaa_pairwise_confidence_intervals(self, measure='kappa', confidence: float = 0.95, n_replicates: int = 1000,
+                                          seed: int = None, workers: int = None,
+                                          alignment: str = 'exact') -> pd.DataFrame:
+        """
+        Returns the DataFrame of View.iaa_pairwise with the columns lower and upper added, containing the bounds of
+        bootstrap percentile confidence intervals of every pair's score. Replicates resample the units of the view with
+        replacement and are evaluated in batches for all pairs.
+
+        Args:
+            measure: Name of the measure to use, either 'kappa' (default) or 'percentage'.
+            confidence: Confidence level of the intervals, defaults to 0.95.
+            n_replicates: Number of bootstrap replicates, defaults to 1000.
+            seed: Seed for reproducible intervals.
+            workers: Number of processes evaluating chunks of replicates.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        scores = self.iaa_pairwise(measure, alignment=alignment)
+        if scores.empty:
+            return scores
+
+        _, pairs = self._pairwise_bootstrap(measure, n_replicates, seed, workers, alignment)
+        scores['lower'], scores['upper'] = self._percentiles(pairs[..., 1], confidence)
+        return scores
+
+    def _pairwise_bootstrap(self, measure, n_replicates, seed, workers, alignment):
+        if measure not in self._pairwise_iaa_measures:
+            raise ValueError(f'"measure" must be one of {self._pairwise_iaa_measures.keys()}, but was "{measure}"!')
+
+        units, annotators, codes = self._annotator_unit_codes(alignment)
+        labelled = codes >= 0
+        unit_ids, units = np.unique(units[labelled], return_inverse=True)
+        n_labels = len(self.labels)
+        pair_a, _, entry_units, cells = pairwise_confusion_entries(units, annotators[labelled], codes[labelled],
+                                                                    len(self.annotators), n_labels)
+        statistic = partial(pairwise_replicates, entry_units=entry_units, cells=cells, n_pairs=len(pair_a),
+                            n_labels=n_labels, agreement_fn=self._pairwise_iaa_measures[measure])
+        chunk_size = bootstrap_chunk_size(len(unit_ids), len(cells), len(pair_a) * n_labels ** 2)
+        return unit_ids, bootstrap(statistic, len(unit_ids), n_replicates, seed, workers, chunk_size)
+
+    @staticmethod
+    def _pooled_pairwise(pairs):
+        # average of pairwise scores weighted by shared units, per replicate, like View.iaa: pairs without shared units
+        # are left out, an undefined score of any other pair makes the average undefined
+        n, scores = pairs[..., 0], pairs[..., 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 0, n * scores, 0).sum(axis=-1) / n.sum(axis=-1)
+
+    @staticmethod
+    def _percentiles(replicates, confidence):
+        # percentile interval over the replicates (first axis), ignoring replicates in which a score is undefined
+        alpha = (1 - confidence) / 2
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lower, upper = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+        return lower, upper
+
+    def sample(self, fraction: float, by: str = 'sentence', seed: int = None) -> 'View':
+        """
+        Returns a View containing a stratified random sample of the sentences or source files of the current view.
+        Sentences are stratified by source file and by the set of annotators annotating them, source files by the set
+        of annotators. Useful to quickly estimate statistics, e.g. confusion matrices, of very large views.
+
+        Args:
+            fraction: Fraction of sentences or source files to sample.
+            by: Unit of sampling, either 'sentence' (default) or 'document'.
+            seed: Seed for a reproducible sample.
+        """
+        clusters, order = self._sampling_order(by, seed)
+        sampled = np.zeros(len(order), dtype=bool)
+        sampled[order[:int(np.ceil(fraction * len(order)))]] = True
+        return View(self._annotation_dataframe[sampled[clusters]], self.project, self.layer_name, self.feature_name)
+
+    def iter_iaa_estimates(self, measure='krippendorff', level='nominal', by: str = 'sentence',
+                           initial_fraction: float = 0.01, growth: float = 2.0, confidence: float = 0.95,
+                           n_replicates: int = 200, seed: int = None, alignment: str = 'exact'):
+        """
+        Estimates inter-annotator agreement from growing stratified samples of sentences or source files, yielding an
+        AgreementEstimate (sample_size, fraction, estimate, lower, upper) per sample. Every sample extends the previous
+        one, see View.sample. Useful to report a quick estimate for very large views and refine it while the exact value
+        is computed, which is yielded last, as a sample containing the whole view.
+
+        Bounds are bootstrap percentile intervals over the sampled sentences or source files, narrowed by the finite
+        population correction. Bounds of samples of a single sentence or source file are NaN. To keep the cost of all
+        estimates close to that of View.iaa, the bootstrap of a sample resamples at most as many sentences or source
+        files as the view contains, using fewer than n_replicates replicates for larger samples. Samples that would get
+        fewer than a tenth of n_replicates replicates are skipped in favour of the exact value.
+
+        Args:
+            measure: Name of the measure to use, either 'krippendorff' (default), 'kappa' or 'percentage'.
+            level: Variable scale to use, when calculating Krippendorff's Alpha, see View.iaa.
+            by: Unit of sampling, either 'sentence' (default) or 'document'.
+            initial_fraction: Fraction of sentences or source files in the first sample.
+            growth: Factor by which every sample is larger than the previous one.
+            confidence: Confidence level of the bounds, defaults to 0.95.
+            n_replicates: Maximum number of bootstrap replicates per estimate.
+            seed: Seed for reproducible samples and bounds.
+            alignment: How annotations of different annotators are paired into units, either 'exact' (default) or
+                'overlap'. See View.aligned_units.
+        """
+        if measure != 'krippendorff' and measure not in self._pairwise_iaa_measures:
+            possible_measures = ['krippendorff'] + list(self._pairwise_iaa_measures.keys())
+            raise ValueError(f'"measure" must be one of {possible_measures}, but was "{measure}"!')
+
+        order_seed, bootstrap_seed = np.random.SeedSequence(seed).spawn(2)
+        clusters, order = self._sampling_order(by, order_seed)
+        n_clusters = len(order)
+        if n_clusters == 0:
+            return
+        ranks = np.empty(n_clusters, dtype=np.int64)
+        ranks[order] = np.arange(n_clusters)
+        row_ranks = ranks[clusters]
+        rows_by_rank = np.argsort(row_ranks, kind='stable')
+        sorted_ranks = row_ranks[rows_by_rank]
+
+        index = self._annotation_dataframe.index
+        labels, annotators = self.labels, self.annotators
+        annotator_codes = pd.Categorical(index.get_level_values('annotator'), categories=annotators).codes
+        codes = pd.Categorical(self._annotation_dataframe['annotation'].values, categories=labels).codes
+
+        sample_size = 0
+        while True:
+            sample_size = max(sample_size + 1, int(np.ceil(sample_size * growth)),
+                              int(np.ceil(initial_fraction * n_clusters)))
+            # every bootstrap resamples at most as many sentences or source files as the view contains
+            replicates_size = min(n_replicates, n_clusters // sample_size)
+            if sample_size >= n_clusters or replicates_size < max(1, n_replicates // 10):
+                break
+
+            rows = rows_by_rank[:np.searchsorted(sorted_ranks, sample_size)]
+            units = self._align(index[rows], alignment)
+            aligned = (units >= 0) & (codes[rows] >= 0)
+            units, row_codes = units[aligned], codes[rows][aligned].astype(np.int64)
+            # sampled sentences or source files are the units of resampling
+            unit_ranks = np.zeros(units.max(initial=-1) + 1, dtype=np.int64)
+            unit_ranks[units] = row_ranks[rows][aligned]
+
+            if measure == 'krippendorff':
+                entry_units, cells, values = coincidence_entries(units, row_codes, len(labels))
+                statistic = partial(alpha_replicates, entry_units=unit_ranks[entry_units], cells=cells,
+                                    values=values, labels=labels, level=level)
+                n_cells = len(labels) ** 2
+            else:
+                pair_a, _, entry_units, cells = pairwise_confusion_entries(
+                    units, annotator_codes[rows][aligned].astype(np.int64), row_codes, len(annotators), len(labels))
+                statistic = partial(self._pooled_pairwise_replicates, entry_units=unit_ranks[entry_units],
+                                    cells=cells, n_pairs=len(pair_a), n_labels=len(labels),
+                                    agreement_fn=self._pairwise_iaa_measures[measure])
+                n_cells = len(pair_a) * len(labels) ** 2
+
+            estimate = statistic(np.ones((1, sample_size), dtype=np.int64))[0]
+            if sample_size < 2:  # a single sentence or source file gives no information on the variance
+                yield AgreementEstimate(sample_size, sample_size / n_clusters, estimate, np.nan, np.nan)
+                continue
+
+            replicates = bootstrap(statistic, sample_size, replicates_size, bootstrap_seed.spawn(1)[0],
+                                   chunk_size=bootstrap_chunk_size(sample_size, len(cells), n_cells))
+            lower, upper = self._percentiles(replicates, confidence)
+            correction = np.sqrt(1 - sample_size / n_clusters)
+            yield AgreementEstimate(sample_size, sample_size / n_clusters, estimate,
+                                    estimate - (estimate - lower) * correction,
+                                    estimate + (upper - estimate) * correction)
+
+        estimate = self.iaa(measure, level, alignment=alignment)
+        yield AgreementEstimate(n_clusters, 1.0, estimate, estimate, estimate)
+
+    @classmethod
+    def _pooled_pairwise_replicates(cls, weights, **kwargs):
+        return cls._pooled_pairwise(pairwise_replicates(weights, **kwargs))
+
+    def _sampling_order(self, by='sentence', seed=None):
+        # cluster id of every annotation and the order in which clusters are sampled, see utils.stratified_order
+        index = self._annotation_dataframe.index
+        files = index.codes[index.names.index('source_file')].astype(np.int64)
+        if by == 'sentence':
+            sentences = index.codes[index.names.index('sentence')].astype(np.int64)
+            keys = files * (len(index.levels[index.names.index('sentence')]) + 1) + sentences
+        elif by == 'document':
+            keys = files
+        else:
+            raise ValueError(f'"by" must be one of {["sentence", "document"]}, but was "{by}"!')
+
+        cluster_keys, clusters = np.unique(keys, return_inverse=True)
+        annotators = index.codes[index.names.index('annotator')].astype(np.int64)
+        sets = annotator_sets(clusters, annotators, len(cluster_keys))
+        if by == 'sentence':
+            cluster_files = np.zeros(len(cluster_keys), dtype=np.int64)
+            cluster_files[clusters] = files
+            strata = np.unique(np.stack([cluster_files, sets], axis=1), axis=0, return_inverse=True)[1].ravel()
+        else:
+            strata = sets
+        return clusters, stratified_order(strata, seed)
\ No newline at end of file
@@ -1,15 +1,32 @@
+import asyncio
 import cassis
+import hashlib
+import json
+import logging
+import os
 import re
+import requests
+import signal
+import threading
+import weakref
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from io import BytesIO
+from itertools import accumulate
 from pathlib import Path
-from zipfile import ZipFile
+from threading import Lock
+from zipfile import ZipFile, ZIP_STORED
 import pandas as pd
-from sklearn.metrics import confusion_matrix as conf_mat
+from pandas.api.types import union_categoricals
 import numpy as np
-from typing import List, Union
+from typing import List, Union, Tuple, Sequence, Dict, Callable
 from pygamma_agreement import Continuum, CombinedCategoricalDissimilarity
 from pyannote.core import Segment
 
+logger = logging.getLogger(__name__)
+
 ###
 # UIMA / Cassis Utils
 ###
@@ -39,103 +56,2048 @@ def extend_layer_name(layer_name, prefix='webanno.custom'):
 def construct_feature_path(layer, feature, sep='>'):
     return f'{layer}{sep}{feature}'
 
+
+###
+# Sentence Index
+###
+
+
+class SentenceIndex:
+    """
+    Assigns the annotations of a CAS to the sentences covering them. Sentences are read once and annotations of a
+    layer are assigned by binary search over sentence offsets the first time the layer is requested. Assignments are
+    reused on subsequent requests.
+
+    Args:
+        cas: The CAS to index.
+    """
+
+    def __init__(self, cas: cassis.Cas):
+        self._cas = weakref.ref(cas)
+        self.sentences = sorted(cas.select(SENTENCE_TYPE_NAME), key=lambda s: (s.begin, s.end))
+        self._begins = [sentence.begin for sentence in self.sentences]
+        self._max_ends = list(accumulate((sentence.end for sentence in self.sentences), max))
+        self._sentence_texts = None
+        self._covered = {}
+
+    @property
+    def sentence_texts(self) -> List[str]:
+        """Returns the texts covered by the indexed sentences."""
+        if self._sentence_texts is None:
+            text = self._cas().sofa_string
+            self._sentence_texts = [text[sentence.begin:sentence.end] for sentence in self.sentences]
+        return self._sentence_texts
+
+    def covered(self, layer_name: str) -> List[list]:
+        """
+        Returns a list containing a list of covered annotations of the given layer for every sentence. An annotation
+        is covered by a sentence if it lies within the sentence's offsets. Annotations keep the order of CAS.select.
+        """
+        if layer_name not in self._covered:
+            self._covered[layer_name] = self._assign(layer_name)
+        return self._covered[layer_name]
+
+    def _assign(self, layer_name):
+        covered = [[] for _ in self.sentences]
+        if not self.sentences:
+            return covered
+
+        try:
+            annotations = self._cas().select(layer_name)
+        except cassis.typesystem.TypeNotFoundError:
+            return covered
+
+        for annotation in annotations:
+            begin, end = annotation.begin, annotation.end
+            i = bisect_right(self._begins, begin) - 1
+            # walk back over preceding sentences that may still cover the annotation (overlapping sentences)
+            while i >= 0 and self._max_ends[i] >= end:
+                if self.sentences[i].end >= end:
+                    covered[i].append(annotation)
+                i -= 1
+
+        return covered
+
+
+###
+# DataFrame Utils
+###
+
+
+def decode_categoricals(data: Union[pd.Series, pd.DataFrame]) -> Union[pd.Series, pd.DataFrame]:
+    """Returns the given Series or DataFrame with categorical data converted back to the dtype of its categories."""
+    if isinstance(data, pd.DataFrame):
+        data = data.copy(deep=False)
+        for column in data.columns:
+            data[column] = decode_categoricals(data[column])
+        return data
+
+    if isinstance(data.dtype, pd.CategoricalDtype):
+        dtype = object if data.hasnans else data.cat.categories.dtype
+        return data.astype(dtype)
+
+    return data
+
+
+def concat_annotations(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates annotation tables, keeping categorical columns categorical by taking the union of their categories.
+    Categories are sorted if possible, as in tables built from scratch.
+    """
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    combined = pd.concat(frames)
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns = [frame[column] for frame in frames]
+            try:
+                values = union_categoricals(columns, sort_categories=True)
+            except TypeError:  # categories of mixed types cannot be sorted
+                values = union_categoricals(columns)
+            combined[column] = pd.Categorical(values)
+    return combined
+
+
+def ensure_list(values) -> Union[list, None]:
+    """Returns the given values as a list. Strings and other scalars are wrapped in a list, None is returned as is."""
+    if values is None:
+        return None
+    if isinstance(values, str) or not pd.api.types.is_list_like(values):
+        return [values]
+    return list(values)
+
+
+def label_mask(annotations, labels: List[any], include: bool = True) -> np.ndarray:
+    """
+    Returns a boolean mask selecting the annotations whose label is one of the given labels. If include is false, the
+    mask selects all other annotations instead.
+
+    Args:
+        annotations: Sequence of labels, one per annotation.
+        labels: Labels to select.
+        include: Whether to select annotations with (True, default) or without (False) the given labels.
+    """
+    mask = np.asarray(pd.Series(annotations).isin(labels), dtype=bool)
+    return mask if include else ~mask
+
+
+def sentence_label_mask(sentences, annotations, labels: List[any], include: bool = True) -> np.ndarray:
+    """
+    Returns a boolean mask selecting all annotations of sentences that contain at least one annotation with any of the
+    given labels. If include is false, the mask selects all annotations of sentences that lack at least one of the
+    given labels instead.
+
+    Args:
+        sentences: Sequence of sentence ids, one per annotation.
+        annotations: Sequence of labels, one per annotation.
+        labels: Labels to look for.
+        include: Whether to select sentences containing (True, default) or lacking (False) the given labels.
+    """
+    sentences = pd.Series(np.asarray(sentences, dtype=object))
+    matches = label_mask(annotations, labels)
+
+    if include:
+        return np.asarray(sentences.isin(sentences[matches].unique()), dtype=bool)
+
+    found = pd.DataFrame({'sentence': sentences[matches].values,
+                          'label': np.asarray(annotations, dtype=object)[matches]}).drop_duplicates()
+    n_found = found.groupby('sentence').size()
+    complete = n_found.index[n_found == len(set(labels))]
+    return ~np.asarray(sentences.isin(complete), dtype=bool)
+
+
+class CountCube:
+    """
+    Sparse cube of annotation counts over the axes annotators, source files and labels, holding the observed cells
+    only. Counts grouped by any combination of the axes, and counts of subsets of annotators or source files, are
+    reductions of the observed cells and do not depend on the number of annotations, nor on the size of the full cube.
+
+    Args:
+        cells: Integer array of shape (3, cells) containing the annotator, source file and label id of every observed
+            cell.
+        counts: Number of annotations of every observed cell.
+        annotators: Annotators referred to by the annotator ids.
+        source_files: Source files referred to by the source file ids.
+        labels: Labels referred to by the label ids.
+    """
+
+    axes = ('annotator', 'source_file', 'annotation')
+
+    def __init__(self, cells: np.ndarray, counts: np.ndarray, annotators: List[str], source_files: List[str],
+                 labels: List[any]):
+        self.cells = cells
+        self.counts = counts
+        self.coords = {
+            'annotator': pd.Index(annotators, name='annotator', dtype=object),
+            'source_file': pd.Index(source_files, name='source_file', dtype=object),
+            'annotation': pd.Index(labels, name='annotation', dtype=object),
+        }
+
+    @classmethod
+    def from_annotations(cls, annotations: pd.DataFrame, labels: List[any], source_files: List[str] = ()):
+        """
+        Builds a CountCube from an annotation table.
+
+        Args:
+            annotations: DataFrame indexed by source_file and annotator, containing an annotation column.
+            labels: Labels along the label axis. Annotations with other labels are not counted.
+            source_files: Source files to include along the file axis, even if they do not contain annotations.
+        """
+        annotator_codes, annotators = pd.factorize(annotations.index.get_level_values('annotator'), sort=True)
+        file_values = annotations.index.get_level_values('source_file')
+        source_files = sorted(set(file_values).union(source_files))
+        file_codes = pd.Categorical(file_values, categories=source_files).codes.astype(np.int64)
+        codes = pd.Categorical(np.asarray(annotations['annotation'], dtype=object), categories=labels).codes
+
+        shape = (len(annotators), len(source_files), len(labels))
+        counted = codes >= 0
+        keys = np.ravel_multi_index((annotator_codes[counted], file_codes[counted], codes[counted]), shape)
+        keys, counts = np.unique(keys, return_counts=True)
+        cells = np.stack(np.unravel_index(keys, shape)).astype(np.int64).reshape(3, -1)
+        return cls(cells, counts, annotators.tolist(), source_files, labels)
+
+    def subset(self, annotators: List[str] = None, source_files: List[str] = None) -> 'CountCube':
+        """Returns a CountCube restricted to the given annotators and source files. None keeps all of them."""
+        cells, counts = self.cells, self.counts
+        coords = {axis: self.coords[axis] for axis in self.axes}
+        for i, (axis, values) in enumerate([('annotator', annotators), ('source_file', source_files)]):
+            if values is not None:
+                kept = coords[axis].isin(values)
+                new_ids = np.cumsum(kept) - 1
+                observed = kept[cells[i]]
+                cells, counts = cells[:, observed].copy(), counts[observed]
+                cells[i] = new_ids[cells[i]]
+                coords[axis] = coords[axis][kept]
+        return CountCube(cells, counts, *(coords[axis] for axis in self.axes))
+
+    def total(self, grouped_by: Union[str, Sequence[str]] = None, include_zeros: bool = False):
+        """
+        Returns the number of annotations, or a Series of counts if grouped_by is given.
+
+        Args:
+            grouped_by: Name of an axis or list of axis names to group the counts by. The order of the names
+                determines the nesting order.
+            include_zeros: If True, combinations without annotations are included with a count of 0.
+        """
+        if grouped_by is None:
+            return self.counts.sum()
+
+        grouped_by = ensure_list(grouped_by)
+        shape = tuple(len(self.coords[axis]) for axis in grouped_by)
+        keys = np.ravel_multi_index([self.cells[self.axes.index(axis)] for axis in grouped_by], shape)
+        if include_zeros:
+            keys, totals = np.arange(int(np.prod(shape))), np.bincount(keys, self.counts, int(np.prod(shape)))
+        else:
+            keys, groups = np.unique(keys, return_inverse=True)
+            totals = np.bincount(groups, self.counts, len(keys))
+
+        group_codes = np.unravel_index(keys, shape)
+        if len(grouped_by) > 1:
+            index = pd.MultiIndex(levels=[self.coords[axis] for axis in grouped_by], codes=group_codes, names=grouped_by)
+        else:
+            index = self.coords[grouped_by[0]][group_codes[0]]
+        return pd.Series(totals.astype(np.int64), index=index, name='annotation')
+
+    def value_counts(self, grouped_by: Union[str, Sequence[str]] = None) -> pd.Series:
+        """
+        Returns label counts sorted in descending order, within each group if grouped_by is given.
+
+        Args:
+            grouped_by: Name of an axis or list of axis names to group the counts by.
+        """
+        grouped_by = ensure_list(grouped_by) or []
+        totals = self.total(grouped_by + ['annotation'])
+        totals.name = 'count'
+        if not grouped_by:
+            return totals.sort_values(ascending=False, kind='stable')
+        group_codes = [totals.index.codes[i] for i in range(len(grouped_by))]
+        order = np.lexsort([-totals.values] + group_codes[::-1])
+        return totals.iloc[order]
+
+
 ###
 # IO Utils
 ###
 
 
-def annotation_info_from_xmi_zip(project_fp: str):
+@contextmanager
+def open_project_zip(project_fp: Union[str, ZipFile]):
+    """
+    Context manager yielding an opened Inception XMI export. Paths and filelike objects are opened and closed again on
+    exit, already opened ZipFiles are yielded as they are and stay open, so that one export can be shared by several
+    readers without being reopened.
+
+    Args:
+        project_fp: String representing a path to an Inception XMI export, a filelike object representing a zip file or
+            an opened ZipFile.
+    """
+    if isinstance(project_fp, ZipFile):
+        yield project_fp
+    else:
+        with ZipFile(project_fp) as project_zip:
+            yield project_zip
+
+
+@contextmanager
+def open_annotation_zip(project_zip: ZipFile, file_path: str):
+    """
+    Context manager yielding an annotation archive nested in an opened Inception XMI export. Uncompressed archives are
+    read directly from the export. Compressed archives are buffered, as reading their directory from a stream requires
+    seeking, which decompresses the archive again for every seek. Only the compressed archive is buffered, its members
+    are streamed, and the buffer is released on exit.
+
+    Args:
+        project_zip: Opened Inception XMI export.
+        file_path: Path of the nested annotation zip inside the project export.
+    """
+    if project_zip.getinfo(file_path).compress_type == ZIP_STORED:
+        annotation_stream = project_zip.open(file_path)
+    else:
+        annotation_stream = BytesIO(project_zip.read(file_path))
+
+    with annotation_stream, ZipFile(annotation_stream) as annotation_zip:
+        yield annotation_zip
+
+
+def annotation_zip_paths(project_zip: ZipFile) -> List[str]:
+    """Returns the paths of all annotation and curation archives nested in an opened Inception XMI export."""
+    regex = re.compile('.*(annotation|curation)/.*/(?!\\._).*zip$')
+    return [fp for fp in project_zip.namelist() if regex.match(fp)]
+
+
+def typesystem_from_annotation_zip(annotation_zip: ZipFile):
+    """Returns the typesystem stored in an annotation archive nested in an Inception XMI export."""
+    with annotation_zip.open('TypeSystem.xml') as typesystem_stream:
+        return cassis.load_typesystem(typesystem_stream)
+
+
+def annotation_info_from_xmi_zip(project_fp: Union[str, ZipFile]):
     """
     Returns a list of tuples containing information about annotations. Tuples contain (CAS, Source File Name, Annotator name).
 
     Args:
-        project_fp: String representing a path to an Inception XMI export.
+        project_fp: String representing a path to an Inception XMI export or an opened ZipFile of an export.
+    """
+    with open_project_zip(project_fp) as project_zip:
+        annotation_fps = annotation_zip_paths(project_zip)
+
+        if not annotation_fps:
+            raise RuntimeError('Could not parse project or empty project.')
+
+        with open_annotation_zip(project_zip, annotation_fps[0]) as annotation_zip:
+            typesystem = typesystem_from_annotation_zip(annotation_zip)
+
+        annotations = []
+        for file_path in annotation_fps:
+            with open_annotation_zip(project_zip, file_path) as annotation_zip:
+                annotations.append(annotation_info_from_annotation_zip(annotation_zip, file_path, typesystem))
+
+    return annotations
+
+
+def annotation_info_from_annotation_zip(annotation_zip: Union[bytes, ZipFile], file_path: str, typesystem):
+    """
+    Returns a tuple (CAS, Source File Name, Annotator name) for a single annotation archive nested in an XMI export.
+    The XMI document is parsed incrementally from a stream of the archive.
+
+    Args:
+        annotation_zip: Opened nested annotation zip or its bytes.
+        file_path: Path of the nested annotation zip inside the project export.
+        typesystem: Typesystem used to deserialize the CAS.
+    """
+    if isinstance(annotation_zip, bytes):
+        with ZipFile(BytesIO(annotation_zip)) as opened_zip:
+            return annotation_info_from_annotation_zip(opened_zip, file_path, typesystem)
+
+    cas_file = next(f for f in annotation_zip.namelist() if f.endswith('.xmi'))
+    cas = load_cas_from_annotation_zip(annotation_zip, typesystem, cas_file)
+
+    source_file = Path(file_path).parent.name
+    annotator = Path(cas_file).stem
+    return cas, source_file, annotator
+
+
+def load_cas_from_annotation_zip(annotation_zip: ZipFile, typesystem, cas_file: str = None) -> cassis.Cas:
+    """
+    Returns the CAS stored in an annotation archive, parsing the XMI document incrementally from a stream.
+
+    Args:
+        annotation_zip: Opened annotation archive.
+        typesystem: Typesystem used to deserialize the CAS.
+        cas_file: Name of the XMI document in the archive. If None, the first XMI document is used.
+    """
+    cas_file = cas_file or next(f for f in annotation_zip.namelist() if f.endswith('.xmi'))
+    with annotation_zip.open(cas_file) as cas_stream:
+        return cassis.load_cas_from_xmi(cas_stream, typesystem)
+
+
+def annotation_index_from_xmi_zip(project_fp: Union[str, ZipFile]):
+    """
+    Returns the typesystem of an Inception XMI export and a list of tuples (Annotation Zip Path, Source File Name,
+    Annotator name) describing its annotation documents. No CAS is deserialized.
+
+    Args:
+        project_fp: String representing a path to an Inception XMI export or an opened ZipFile of an export.
     """
-    annotations = []
-    with ZipFile(project_fp) as project_zip:
-        regex = re.compile('.*(annotation|curation)/.*/(?!\._).*zip$')
-        annotation_fps = (fp for fp in project_zip.namelist() if regex.match(fp))
+    with open_project_zip(project_fp) as project_zip:
+        annotation_fps = annotation_zip_paths(project_zip)
+
+        if not annotation_fps:
+            raise RuntimeError('Could not parse project or empty project.')
 
         typesystem = None
+        index = []
         for file_path in annotation_fps:
-            with ZipFile(BytesIO(project_zip.read(file_path))) as annotation_zip:
+            with open_annotation_zip(project_zip, file_path) as annotation_zip:
                 if typesystem is None:
-                    typesystem = cassis.load_typesystem(BytesIO(annotation_zip.read('TypeSystem.xml')))
+                    typesystem = typesystem_from_annotation_zip(annotation_zip)
 
                 cas_file = next(f for f in annotation_zip.namelist() if f.endswith('.xmi'))
-                cas = cassis.load_cas_from_xmi(BytesIO(annotation_zip.read(cas_file)), typesystem)
-                source_file = Path(file_path).parent.name
-                annotator = Path(cas_file).stem
-
-                annotations.append((cas, source_file, annotator))
-    
-    if not annotations:
-        raise RuntimeError('Could not parse project or empty project.')
-    
-    return annotations
+                index.append((file_path, Path(file_path).parent.name, Path(cas_file).stem))
+
+    return typesystem, index
+
+
+class CasLoader:
+    """
+    Deserializes CAS objects from the annotation archives of an Inception XMI export on demand. Only the most recently
+    used CAS objects are kept in memory.
+
+    Args:
+        project_fp: String representing a path to an Inception XMI export, a filelike object representing a zip file or
+            an opened ZipFile of an export. An opened ZipFile is closed together with the loader.
+        typesystem: Typesystem used to deserialize the CAS objects.
+        max_cached: Maximum number of deserialized CAS objects kept in memory. If None, all loaded CAS objects are kept.
+    """
+
+    def __init__(self, project_fp, typesystem, max_cached: int = 128):
+        self.typesystem = typesystem
+        self.cache = LRUCache(max_cached)
+        self._project_zip = project_fp if isinstance(project_fp, ZipFile) else ZipFile(project_fp)
+
+    def __call__(self, file_path: str) -> cassis.Cas:
+        """Returns the CAS contained in the annotation archive at the given path of the export."""
+        cas = self.cache.get(file_path)
+        if cas is None:
+            with open_annotation_zip(self._project_zip, file_path) as annotation_zip:
+                cas, _, _ = annotation_info_from_annotation_zip(annotation_zip, file_path, self.typesystem)
+            self.cache.put(file_path, cas)
+        return cas
+
+    def clear(self):
+        """Removes all deserialized CAS objects from memory."""
+        self.cache.clear()
+
+    def close(self):
+        """Closes the underlying export."""
+        self.clear()
+        self._project_zip.close()
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion and returns its result. Within a running event loop, e.g. in Jupyter, the coroutine
+    is run in a separate thread with its own event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class RemoteLoader:
+    """
+    Loads the annotation documents of a project from the Remote API of an Inception instance, document by document.
+    Documents are fetched concurrently over a pooled HTTP session and parsed as they arrive. Requests are bounded by
+    max_connections and retried with exponential backoff if the server is temporarily unavailable or the connection
+    fails or times out.
+
+    Requests are issued from worker threads driven by an asyncio event loop, so loading can be awaited from
+    asynchronous code via RemoteLoader.load or run to completion via RemoteLoader.load_sync.
+
+    Args:
+        remote_url: Url of the Inception instance. If None, the environment variable INCEPTION_HOST is used.
+        auth: Tuple (user, password). If None, the environment variables INCEPTION_USERNAME and INCEPTION_PASSWORD are
+            used.
+        max_connections: Maximum number of concurrent requests.
+        max_retries: Maximum number of retries of a failed request.
+        timeout: Number of seconds to wait for a response.
+    """
+
+    api_path = '/api/aero/v1'
+    retry_statuses = (408, 429, 502, 503, 504)
+    retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, remote_url: str = None, auth: Tuple[str, str] = None, max_connections: int = 8,
+                 max_retries: int = 3, timeout: float = 60):
+        remote_url = remote_url or os.environ['INCEPTION_HOST']
+        auth = auth or (os.environ['INCEPTION_USERNAME'], os.environ['INCEPTION_PASSWORD'])
+        self.base_url = remote_url.rstrip('/') + self.api_path
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._semaphore = None
+
+    async def _get(self, path: str, **params) -> requests.Response:
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await asyncio.to_thread(self.session.get, self.base_url + path,
+                                                       params=params or None, timeout=self.timeout)
+                except self.retry_exceptions:
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                        break
+                await asyncio.sleep(2 ** attempt / 10)
+
+        response.raise_for_status()
+        return response
+
+    async def _body(self, path: str, **params):
+        response = await self._get(path, **params)
+        return response.json()['body']
+
+    async def project_id(self, project: Union[int, str]) -> int:
+        """Returns the id of the given project. Project names are matched like in Project.from_remote."""
+        if not isinstance(project, str):
+            return project
+
+        name = project.replace(' ', '-').lower()
+        projects = [p for p in await self._body('/projects') if p['name'] == name]
+        if len(projects) == 0:
+            raise ValueError(f'There exists no project with name {name}')
+        return projects[0]['id']
+
+    async def documents(self, project_id: int) -> List[dict]:
+        """Returns the documents of a project as dictionaries with keys 'id', 'name' and 'state'."""
+        return await self._body(f'/projects/{project_id}/documents')
+
+    async def annotations(self, project_id: int, document_id: int) -> List[dict]:
+        """Returns the annotation documents of a document as dictionaries with keys 'user', 'state' and 'timestamp'."""
+        return await self._body(f'/projects/{project_id}/documents/{document_id}/annotations')
+
+    async def index(self, project_id: int, documents: List[dict] = None) -> List[Tuple[int, str, str, tuple]]:
+        """
+        Returns a list of tuples (Document id, Source File Name, Annotator name, Remote state) describing all
+        annotation documents of a project, including curated documents, whose annotator is CURATION_USER. The remote
+        state is a tuple of the state and the modification timestamp of the annotation document, if known.
+
+        Args:
+            project_id: Id of the project.
+            documents: Documents of the project, as returned by RemoteLoader.documents. Requested if None.
+        """
+        if documents is None:
+            documents = await self.documents(project_id)
+        annotations = await asyncio.gather(*(self.annotations(project_id, d['id']) for d in documents))
+
+        index = []
+        for document, document_annotations in zip(documents, annotations):
+            for annotation in document_annotations:
+                state = (annotation['state'], annotation.get('timestamp'))
+                index.append((document['id'], document['name'], annotation['user'], state))
+            if document['state'].startswith('CURATION'):
+                index.append((document['id'], document['name'], 'CURATION_USER', (document['state'], None)))
+        return index
+
+    async def fetch(self, project_id: int, document_id: int, annotator: str, typesystem=None, digest: str = None):
+        """
+        Downloads and parses a single annotation document. Returns a tuple (CAS, Typesystem, Digest). The digest
+        identifies the content of the XMI document by its CRC-32 checksum and size.
+
+        Args:
+            project_id: Id of the project.
+            document_id: Id of the document.
+            annotator: Name of the annotator, or CURATION_USER for the curated document.
+            typesystem: Typesystem used to deserialize the CAS. If None, the typesystem contained in the download is
+                used.
+            digest: Digest of a previously loaded version of the document. If the downloaded document has the same
+                digest, it is not parsed and None is returned instead of a CAS.
+        """
+        if annotator == 'CURATION_USER':
+            path = f'/projects/{project_id}/documents/{document_id}/curation'
+        else:
+            path = f'/projects/{project_id}/documents/{document_id}/annotations/{annotator}'
+        response = await self._get(path, format='xmi')
+
+        def parse():
+            with ZipFile(BytesIO(response.content)) as annotation_zip:
+                cas_info = next(i for i in annotation_zip.infolist() if i.filename.endswith('.xmi'))
+                document_digest = f'{cas_info.CRC:08x}-{cas_info.file_size}'
+                if document_digest == digest:
+                    return None, typesystem, document_digest
+
+                document_typesystem = typesystem or typesystem_from_annotation_zip(annotation_zip)
+                cas = load_cas_from_annotation_zip(annotation_zip, document_typesystem, cas_info.filename)
+                return cas, document_typesystem, document_digest
+
+        return await asyncio.to_thread(parse)
+
+    async def load(self, project: Union[int, str]):
+        """
+        Returns the typesystem of a project, a list of tuples (CAS, Source File Name, Annotator name) of its
+        annotation documents, the names of all source files and the states of the annotation documents, which can be
+        passed to RemoteLoader.refresh.
+
+        Args:
+            project: Id or name of the project.
+        """
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        project_id = await self.project_id(project)
+        documents = await self.documents(project_id)
+        index = await self.index(project_id, documents)
+
+        if not index:
+            raise RuntimeError('Could not parse project or empty project.')
+
+        # the typesystem is taken from the first document and shared by all others
+        first = await self.fetch(project_id, index[0][0], index[0][2])
+        typesystem = first[1]
+        rest = await asyncio.gather(*(self.fetch(project_id, document_id, annotator, typesystem)
+                                      for document_id, _, annotator, _ in index[1:]))
 
+        annotations, states = [], {}
+        for (cas, _, digest), (_, source_file, annotator, state) in zip([first] + rest, index):
+            annotations.append((cas, source_file, annotator))
+            states[source_file, annotator] = (state, digest)
+        return typesystem, annotations, [document['name'] for document in documents], states
 
-def source_files_from_xmi_zip(project_fp: str):
+    async def refresh(self, project: Union[int, str], states: Dict[Tuple[str, str], tuple], typesystem):
+        """
+        Fetches the annotation documents of a project that changed since they were loaded. Documents whose remote
+        state is unchanged are skipped, if the remote API reports modification timestamps. Other documents are
+        downloaded, but only parsed if the digest of their content changed.
+
+        Returns the keys (Source File Name, Annotator name) of all current annotation documents in remote order, a
+        dictionary mapping the keys of changed and added documents to their CAS, the names of all source files and the
+        updated states.
+
+        Args:
+            project: Id or name of the project.
+            states: States of the loaded annotation documents, as returned by RemoteLoader.load or RemoteLoader.refresh.
+            typesystem: Typesystem used to deserialize changed documents.
+        """
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        project_id = await self.project_id(project)
+        documents = await self.documents(project_id)
+        index = await self.index(project_id, documents)
+
+        candidates = []
+        for document_id, source_file, annotator, state in index:
+            known_state, digest = states.get((source_file, annotator), (None, None))
+            if state != known_state or state[1] is None:
+                candidates.append((document_id, source_file, annotator, state, digest))
+
+        fetched = await asyncio.gather(*(self.fetch(project_id, document_id, annotator, typesystem, digest)
+                                         for document_id, _, annotator, _, digest in candidates))
+
+        updated_states = {(source_file, annotator): states.get((source_file, annotator))
+                          for _, source_file, annotator, _ in index}
+        changed = {}
+        for (cas, _, digest), (_, source_file, annotator, state, _) in zip(fetched, candidates):
+            updated_states[source_file, annotator] = (state, digest)
+            if cas is not None:
+                changed[source_file, annotator] = cas
+
+        keys = [(source_file, annotator) for _, source_file, annotator, _ in index]
+        return keys, changed, [document['name'] for document in documents], updated_states
+
+    def load_sync(self, project: Union[int, str]):
+        """Runs RemoteLoader.load to completion, also from within a running event loop, e.g. in Jupyter."""
+        return run_sync(self.load(project))
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.session.close()
+
+
+def source_files_from_xmi_zip(project_fp: Union[str, ZipFile]):
     """
     Returns the list of all source file names of the project.
 
     Args:
-        project_fp: String representing a path to an exported Inception XMI export.
+        project_fp: String representing a path to an exported Inception XMI export or an opened ZipFile of an export.
     """
-    with ZipFile(project_fp) as project_zip:
-        return [fp.split('/', 1)[1] for fp in project_zip.namelist() if fp.startswith('source/')]
+    # exports may be nested in a top level folder, resource forks of macOS archives are skipped
+    regex = re.compile('^(?!__MACOSX/)(?:.*/)?source/(?!\\._)([^/]+)$')
+    with open_project_zip(project_fp) as project_zip:
+        return [match.group(1) for match in map(regex.match, project_zip.namelist()) if match]
 
 
 ###
-# Statistics
+# Caching Utils
 ###
 
 
-def confusion_matrix(da_matrix: pd.DataFrame,
-                     annotators: Union[List[int], List[str]],
-                     labels: List[any] = None) -> pd.DataFrame:
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
 
-    M = da_matrix[annotators].dropna()
-    a, b = annotators
 
-    if isinstance(a, int):
-        annos_a = M.iloc[:, a]
-        annos_b = M.iloc[:, b]
-    else:
-        annos_a = M.loc[:, a]
-        annos_b = M.loc[:, b]
+class LRUCache:
+    """
+    Thread-safe mapping holding a bounded number of entries. When full, the least recently used entry is evicted.
+    Lookups are counted as hits or misses.
 
-    return conf_mat(annos_a, annos_b, labels=labels)
+    Args:
+        maxsize: Maximum number of entries. If None, the cache is unbounded. If 0, nothing is cached.
+    """
 
+    def __init__(self, maxsize: int = 128):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
 
-def zero_diag_cm_df(cm_df):
-    cm_df = cm_df.copy()
-    labels = cm_df.columns
-    for i in labels:
-        cm_df.loc[i, i] = 0
-    return cm_df
+    @property
+    def maxsize(self) -> int:
+        """Returns the maximum number of entries. Setting a smaller size evicts entries immediately."""
+        return self._maxsize
 
+    @maxsize.setter
+    def maxsize(self, maxsize: int):
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
 
-def percentage_agreement(a, b):
-    a = np.asarray(a)
-    b = np.asarray(b)
-    return sum(a == b) / a.shape[0]
+    def __len__(self):
+        return len(self._entries)
 
+    def __contains__(self, key):
+        return key in self._entries
 
-def gamma_agreement(annotation_df: pd.DataFrame) -> float:
-    def gamma_for_continuum(df, dissimilarity):
-        continuum = Continuum()
-        for _, _, annotator, begin, end, annotation in df.itertuples():
-            continuum.add(annotator, Segment(begin, end), annotation)
-        return continuum.compute_gamma(dissimilarity, fast=True).gamma
+    def get(self, key, default=None):
+        """Returns the entry for the given key, marking it as recently used, or default if there is none."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Adds an entry, evicting the least recently used entries if the cache is full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Removes the entry for the given key and returns it, or default if there is none."""
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def keys(self) -> list:
+        """Returns the keys of all entries, from least to most recently used."""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        """Removes all entries and resets the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> CacheInfo:
+        """Returns hit and miss counts, maximum and current size of the cache."""
+        return CacheInfo(self.hits, self.misses, self._maxsize, len(self._entries))
+
+    def _evict(self):
+        if self._maxsize is not None:
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+def export_fingerprint(project_fp) -> str:
+    """
+    Returns a hash identifying the contents of an Inception XMI export. The hash is computed from the names, sizes and
+    CRC-32 checksums stored in the zip directory, so the archive does not have to be decompressed.
+
+    Args:
+        project_fp: String representing a path to an Inception XMI export, a filelike object representing a zip file or
+            an opened ZipFile of an export.
+    """
+    digest = hashlib.sha256()
+    with open_project_zip(project_fp) as project_zip:
+        for info in sorted(project_zip.infolist(), key=lambda i: i.filename):
+            digest.update(f'{info.filename}\0{info.file_size}\0{info.CRC}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AnnotationCache:
+    """
+    Persistent cache of annotation tables extracted from an Inception XMI export. Tables are stored as Parquet files
+    in a subdirectory of the cache directory named after the fingerprint of the export and the version of the cache,
+    so changing the export invalidates all of its cached tables. The index of the annotation documents and the
+    typesystem of the export are stored alongside, so that reopening an unchanged export does not open its annotation
+    archives. The version is increased whenever the extracted
+    tables change, e.g. their columns, index or encoding of sentence ids, so that tables extracted by other versions of
+    the package are not read. Requires pyarrow.
+
+    Args:
+        cache_dir: Directory in which cached tables are stored. Created if it does not exist.
+        project_fp: String representing a path to an Inception XMI export, a filelike object representing a zip file or
+            an opened ZipFile of an export.
+    """
+
+    version = 1
+
+    def __init__(self, cache_dir, project_fp):
+        self.fingerprint = export_fingerprint(project_fp)
+        self.directory = Path(cache_dir) / f'{self.fingerprint}-v{self.version}'
+
+    def _table_path(self, layer_name: str, feature_name: str = None) -> Path:
+        return self.directory / f'{layer_name}#{feature_name or ""}.parquet'
+
+    def load(self, layer_name: str, feature_name: str = None) -> Union[pd.DataFrame, None]:
+        """Returns the cached annotation table for the given layer and feature or None if it is not cached."""
+        path = self._table_path(layer_name, feature_name)
+        if not path.exists():
+            return None
+
+        return pd.read_parquet(path)
+
+    def store(self, annotations: pd.DataFrame, layer_name: str, feature_name: str = None) -> bool:
+        """
+        Stores the annotation table for the given layer and feature. Returns False if the table could not be stored,
+        e.g. because a column contains values of mixed types.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._table_path(layer_name, feature_name)
+        tmp_path = path.with_suffix('.tmp')
 
-    continuum_dfs = annotation_df[['sentence', 'annotator', 'begin', 'end', 'annotation']].groupby('sentence')
-    diss = CombinedCategoricalDissimilarity()
-    gammas = []
-    for sf, df in continuum_dfs:
         try:
-            gammas.append(gamma_for_continuum(df, diss))
-        except AssertionError:
-            print(f'Could not calculate gamma for source file "{sf}". Skipping.')
+            annotations.to_parquet(tmp_path)
+        except (TypeError, ValueError):  # pyarrow cannot convert mixed type columns
+            tmp_path.unlink(missing_ok=True)
+            return False
+
+        tmp_path.replace(path)
+        return True
+
+    def load_index(self):
+        """
+        Returns the typesystem and the document index of the export stored by AnnotationCache.store_index, see
+        annotation_index_from_xmi_zip, or None if they are not cached.
+        """
+        index_path = self.directory / 'index.json'
+        typesystem_path = self.directory / 'TypeSystem.xml'
+        if not index_path.exists() or not typesystem_path.exists():
+            return None
+
+        with open(typesystem_path, 'rb') as typesystem_file:
+            typesystem = cassis.load_typesystem(typesystem_file)
+        with open(index_path, encoding='utf-8') as index_file:
+            index = [tuple(document) for document in json.load(index_file)]
+        return typesystem, index
+
+    def store_index(self, typesystem, index: List[Tuple[str, str, str]]):
+        """Stores the typesystem and the document index of the export, see annotation_index_from_xmi_zip."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # the typesystem is written first, the index marks a complete entry
+        typesystem.to_xml(self.directory / 'TypeSystem.xml')
+        tmp_path = self.directory / 'index.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file)
+        tmp_path.replace(self.directory / 'index.json')
+
+    def clear(self):
+        """Removes all cached tables of the export."""
+        for path in self.directory.glob('*.parquet'):
+            path.unlink()
+
+
+class ProjectStore:
+    """
+    Columnar store of the annotation tables of a project, which can be reopened without parsing any CAS. Every layer
+    is stored in a directory of NumPy arrays: begin and end offsets, and integer codes of the source files, sentences,
+    annotators, texts and feature values of all annotations. The categories of the codes, the source files, documents
+    and typesystem of the project are stored alongside. Arrays are memory-mapped when the store is opened, so selecting
+    annotations only reads the selected rows, and processes opening the same store share its pages.
+
+    Args:
+        path: Directory containing the store.
+    """
+
+    version = 1
+    location_columns = ['source_file', 'sentence', 'annotator', 'text', '_sentence_text']
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'store.json', encoding='utf-8') as catalogue_file:
+            self.catalogue = json.load(catalogue_file)
+
+        if self.catalogue['version'] != self.version:
+            raise ValueError(f'Unsupported store version {self.catalogue["version"]}, expected {self.version}.')
+
+        with open(self.path / 'TypeSystem.xml', 'rb') as typesystem_file:
+            self.typesystem = cassis.load_typesystem(typesystem_file)
+
+    @property
+    def documents(self) -> List[Tuple[str, str]]:
+        """Returns a list of tuples (Source File Name, Annotator name) of all annotation documents in the store."""
+        return [tuple(document) for document in self.catalogue['documents']]
+
+    @property
+    def source_files(self) -> List[str]:
+        """Returns the names of all source files of the stored project."""
+        return self.catalogue['source_files']
+
+    @classmethod
+    def write(cls, path, typesystem, documents: List[Tuple[str, str]], source_files: List[str],
+              layers: Dict[str, Tuple[pd.DataFrame, Dict[str, pd.Series]]], **metadata) -> 'ProjectStore':
+        """
+        Writes a store and returns it opened.
+
+        Args:
+            path: Directory to write the store to. Created if it does not exist, existing layers are overwritten.
+            typesystem: Typesystem of the project.
+            documents: Tuples (Source File Name, Annotator name) of all annotation documents.
+            source_files: Names of all source files of the project.
+            layers: Mapping of layer names to tuples of an annotation table of the layer, as returned by
+                Project.select, and a mapping of feature names to the annotations of the feature, row-aligned with the
+                table.
+            metadata: Additional JSON serializable entries of the catalogue.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        catalogue = {'version': cls.version, 'documents': [list(document) for document in documents],
+                     'source_files': list(source_files), 'layers': {}, **metadata}
+
+        for layer_name, (annotations, features) in layers.items():
+            layer_path = path / layer_name
+            layer_path.mkdir(exist_ok=True)
+            frame = annotations.reset_index()
+            categories = {}
+
+            columns = {column: frame[column] for column in cls.location_columns}
+            columns.update({f'feature.{name}': values for name, values in features.items()})
+            for column, values in columns.items():
+                values = values.astype('category')
+                categories[column] = values.cat.categories.tolist()
+                np.save(layer_path / f'{column}.npy', values.cat.codes.values.astype(np.int32))
+
+            for column in ['begin', 'end']:
+                np.save(layer_path / f'{column}.npy', frame[column].values.astype(np.int64))
+
+            catalogue['layers'][layer_name] = {'rows': len(frame), 'features': list(features),
+                                               'categories': categories}
+
+        typesystem.to_xml(path / 'TypeSystem.xml')
+
+        tmp_path = path / 'store.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as catalogue_file:
+            json.dump(catalogue, catalogue_file)
+        tmp_path.replace(path / 'store.json')
+
+        return cls(path)
+
+    def _column(self, layer_name: str, column: str) -> np.ndarray:
+        return np.load(self.path / layer_name / f'{column}.npy', mmap_mode='r')
+
+    def load(self, layer_name: str, feature_name: str = None,
+             documents: List[Tuple[str, str]] = None) -> pd.DataFrame:
+        """
+        Returns the annotation table of the given layer and feature, as returned by Project.select.
+
+        Args:
+            layer_name: Name of the layer.
+            feature_name: Name of the feature. If None, the covered texts are used as annotations.
+            documents: Tuples (Source File Name, Annotator name) of the documents to include. If None, annotations of
+                all documents are returned. Only rows of the included documents are read from the arrays.
+        """
+        layer = self.catalogue['layers'].get(layer_name)
+        if layer is None:
+            raise ValueError(f'Layer "{layer_name}" is not contained in the store at {self.path}.')
+        if feature_name is not None and feature_name not in layer['features']:
+            raise ValueError(f'Feature "{feature_name}" of layer "{layer_name}" is not contained in the store at '
+                             f'{self.path}.')
+
+        categories = layer['categories']
+        rows = slice(None)
+        if documents is not None:
+            source_file_codes = pd.Categorical([sf for sf, _ in documents], categories=categories['source_file']).codes
+            annotator_codes = pd.Categorical([a for _, a in documents], categories=categories['annotator']).codes
+            n_annotators = len(categories['annotator'])
+            selected = (source_file_codes.astype(np.int64) * n_annotators + annotator_codes)[
+                (source_file_codes >= 0) & (annotator_codes >= 0)]
+            document_codes = self._column(layer_name, 'source_file').astype(np.int64) * n_annotators + \
+                self._column(layer_name, 'annotator')
+            rows = np.flatnonzero(np.isin(document_codes, selected))
+
+        def categorical(column):
+            return pd.Categorical.from_codes(self._column(layer_name, column)[rows], categories[column])
+
+        def objects(column):
+            return np.asarray(categories[column], dtype=object)[self._column(layer_name, column)[rows]]
+
+        annotations = pd.DataFrame({
+            'text': categorical('text'),
+            'source_file': objects('source_file'),
+            'sentence': objects('sentence'),
+            '_sentence_text': categorical('_sentence_text'),
+            'begin': np.array(self._column(layer_name, 'begin')[rows]),
+            'end': np.array(self._column(layer_name, 'end')[rows]),
+            'annotator': objects('annotator'),
+        }).set_index(['source_file', 'sentence', 'begin', 'end', 'annotator'])
+
+        if feature_name is None:
+            annotations['annotation'] = annotations['text']
+        else:
+            annotations['annotation'] = categorical(f'feature.{feature_name}')
+
+        return annotations
+
+
+###
+# Statistics
+###
+
+
+def exact_units(index: pd.MultiIndex, annotator_level: str = 'annotator') -> np.ndarray:
+    """
+    Returns a unit id per annotation, pairing annotations with identical index entries apart from the annotator, like
+    factorizing the index without the annotator level: units are numbered in order of their first annotation, and
+    annotations with missing index entries get -1. Repeated annotations of an annotator for a unit are coded as -1 as
+    well. Units are derived from the integer codes of the index levels, without hashing the entries.
+
+    Args:
+        index: MultiIndex of an annotation table, e.g. indexed by source_file, sentence, begin, end and annotator.
+        annotator_level: Name of the annotator level.
+    """
+    annotators = index.codes[index.names.index(annotator_level)].astype(np.int64)
+    unit_codes = [codes.astype(np.int64) for name, codes in zip(index.names, index.codes) if name != annotator_level]
+    if not len(index):
+        return np.zeros(0, dtype=np.int64)
+
+    order = np.lexsort([annotators] + unit_codes[::-1])
+    sorted_codes = np.stack([codes[order] for codes in unit_codes])
+    new_unit = np.r_[True, (sorted_codes[:, 1:] != sorted_codes[:, :-1]).any(axis=0)]
+    new_annotation = new_unit | np.r_[True, annotators[order][1:] != annotators[order][:-1]]
+
+    starts = np.flatnonzero(new_unit)
+    first_rows = np.minimum.reduceat(order, starts)
+    ranks = np.empty(len(starts), dtype=np.int64)
+    ranks[np.argsort(first_rows)] = np.arange(len(starts))
+
+    units = np.empty(len(index), dtype=np.int64)
+    units[order] = ranks[np.cumsum(new_unit) - 1]
+    units[order[~new_annotation]] = -1
+    units[(np.stack(unit_codes) < 0).any(axis=0)] = -1
+    return units
+
+
+def align_spans(documents, begins: np.ndarray, ends: np.ndarray, annotators) -> np.ndarray:
+    """
+    Returns a unit id per span, aligning overlapping spans of different annotators within the same document. Spans are
+    swept in order of their begin offsets and grouped into clusters of transitively overlapping spans. Within a
+    cluster, the k-th span of every annotator is assigned to the k-th unit of the cluster, so that every unit contains
+    at most one span per annotator. Spans without overlapping spans form units of their own. Runs in O(n log n).
+
+    Args:
+        documents: Sequence of document ids, one per span.
+        begins: Integer array of begin offsets.
+        ends: Integer array of end offsets.
+        annotators: Sequence of annotators, one per span.
+    """
+    n_spans = len(begins)
+    if n_spans == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    document_codes = pd.factorize(np.asarray(documents, dtype=object))[0].astype(np.int64)
+    annotator_codes, annotator_names = pd.factorize(np.asarray(annotators, dtype=object))
+
+    # shift offsets per document so that a single sweep never joins spans of different documents
+    offsets = document_codes * (int(np.max(ends)) + 1)
+    begins, ends = np.asarray(begins) + offsets, np.asarray(ends) + offsets
+    order = np.lexsort((ends, begins))
+    sorted_begins, sorted_ends = begins[order], ends[order]
+    starts_cluster = np.r_[True, sorted_begins[1:] >= np.maximum.accumulate(sorted_ends)[:-1]]
+    clusters = np.cumsum(starts_cluster) - 1
+
+    # rank of every span among the spans of its annotator within the cluster
+    groups = clusters * len(annotator_names) + annotator_codes[order]
+    by_group = np.argsort(groups, kind='stable')
+    sorted_groups = groups[by_group]
+    group_starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    ranks = np.empty(n_spans, dtype=np.int64)
+    ranks[by_group] = np.arange(n_spans) - np.repeat(group_starts, np.diff(np.r_[group_starts, n_spans]))
+
+    units = np.empty(n_spans, dtype=np.int64)
+    units[order] = pd.factorize(clusters * (ranks.max() + 1) + ranks)[0]
+    return units
+
+
+def annotator_pairs(units: np.ndarray, annotators: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns two arrays of annotation indices, pairing every annotation with the annotations of other annotators in the
+    same unit. Pairs are enumerated unit by unit, so that the work is proportional to the number of annotator pairs
+    that actually share units. The first annotation of every pair has the lower annotator id.
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+    """
+    order = np.lexsort((annotators, units))
+    sorted_units = units[order]
+    _, starts, sizes = np.unique(sorted_units, return_index=True, return_counts=True)
+
+    # pair every annotation with the annotations following it in its unit
+    following = np.repeat(starts + sizes, sizes) - np.arange(len(order)) - 1
+    first = np.repeat(np.arange(len(order)), following)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(following) - following, following)
+    first, second = order[first], order[second]
+
+    distinct = annotators[first] != annotators[second]
+    return first[distinct], second[distinct]
+
+
+def pairwise_confusions(units: np.ndarray, annotators: np.ndarray, codes: np.ndarray, n_annotators: int,
+                        n_labels: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the confusion matrices of all pairs of annotators sharing at least one unit, as three arrays: the ids of
+    the first and second annotators of the pairs, in lexicographic order, and the integer confusion matrices of shape
+    (pairs, labels, labels). Entry [p, i, j] counts the units labelled i by the first and j by the second annotator.
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+        codes: Integer array containing a label id per annotation. Missing labels are coded as -1 and not counted.
+        n_annotators: Number of distinct annotators.
+        n_labels: Number of distinct labels.
+    """
+    pair_a, pair_b, _, cells = pairwise_confusion_entries(units, annotators, codes, n_annotators, n_labels)
+    confusions = np.bincount(cells, minlength=len(pair_a) * n_labels * n_labels)
+    return pair_a, pair_b, confusions.reshape(len(pair_a), n_labels, n_labels)
+
+
+def pairwise_confusion_entries(units: np.ndarray, annotators: np.ndarray, codes: np.ndarray, n_annotators: int,
+                               n_labels: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the pairs of annotators of pairwise_confusions and the contributions to their confusion matrices, as the
+    unit and the cell of the flattened (pairs, labels, labels) array of every counted pair of annotations.
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+        codes: Integer array containing a label id per annotation. Missing labels are coded as -1 and not counted.
+        n_annotators: Number of distinct annotators.
+        n_labels: Number of distinct labels.
+    """
+    valid = codes >= 0
+    units, annotators, codes = units[valid], annotators[valid], codes[valid]
+    first, second = annotator_pairs(units, annotators)
+
+    pair_keys, pair_ids = np.unique(annotators[first] * n_annotators + annotators[second], return_inverse=True)
+    cells = (pair_ids * n_labels + codes[first]) * n_labels + codes[second]
+    return pair_keys // n_annotators, pair_keys % n_annotators, units[first], cells
+
+
+def agreement_from_confusions(confusions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns three arrays containing for every confusion matrix, e.g. of the matrices returned by pairwise_confusions,
+    the number of units annotated by both annotators, the observed agreement and the agreement expected by chance
+    (Cohen) on those units.
+
+    Args:
+        confusions: Integer array of shape (..., labels, labels).
+    """
+    overlap = confusions.sum(axis=(-2, -1))
+    agreements = np.trace(confusions, axis1=-2, axis2=-1)
+    marginals_a, marginals_b = confusions.sum(axis=-1), confusions.sum(axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = agreements / overlap
+        expected = np.einsum('...l,...l->...', marginals_a, marginals_b) / overlap.astype(np.float64) ** 2
+    return overlap, observed, expected
+
+
+def one_vs_rest_agreement(confusions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the arrays of agreement_from_confusions for every label treated as a binary category against all other
+    labels. The observed and expected agreement get an additional last axis of labels.
+
+    Args:
+        confusions: Integer array of shape (..., labels, labels).
+    """
+    overlap = confusions.sum(axis=(-2, -1))
+    n = overlap[..., None].astype(np.float64)
+    hits = np.diagonal(confusions, axis1=-2, axis2=-1)
+    rows, columns = confusions.sum(axis=-1), confusions.sum(axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = (n - rows - columns + 2 * hits) / n
+        expected = (rows * columns + (n - rows) * (n - columns)) / n ** 2
+    return overlap, observed, expected
+
+
+def confusion_matrices_from_pairs(pair_a: np.ndarray, pair_b: np.ndarray, confusions: np.ndarray,
+                                  annotators: List[str], labels: List[any], only_differences: bool = False,
+                                  aggregate: str = None) -> Union[pd.Series, pd.DataFrame]:
+    """
+    Returns pairwise confusion matrices in the format of View.confusion_matrices.
+
+    Args:
+        pair_a: Annotator id of the first annotator of every pair.
+        pair_b: Annotator id of the second annotator of every pair.
+        confusions: Integer array of shape (pairs, labels, labels), as returned by pairwise_confusions.
+        annotators: Annotators referred to by the annotator ids.
+        labels: Labels along the last two axes.
+        only_differences: If set to true, agreements (the diagonals of the matrices) are set to 0.
+        aggregate: Either None, 'by_annotator' or 'total', see View.confusion_matrices.
+    """
+    if only_differences:
+        confusions = confusions.copy()
+        diagonal = np.arange(len(labels))
+        confusions[:, diagonal, diagonal] = 0
+
+    if aggregate == 'by_annotator':
+        totals = np.zeros((len(annotators), len(labels), len(labels)), dtype=confusions.dtype)
+        np.add.at(totals, pair_a, confusions)
+        np.add.at(totals, pair_b, confusions.transpose(0, 2, 1))
+        by_anno = [pd.DataFrame(total, index=pd.Index(labels, name=annotator), columns=pd.Index(labels, name='others'))
+                   for annotator, total in zip(annotators, totals)]
+        return pd.Series(data=by_anno, index=annotators)
+
+    if aggregate == 'total':
+        return pd.DataFrame(confusions.sum(axis=0), index=labels, columns=labels)
+
+    entries = []
+    for i, j, confusion in zip(pair_a, pair_b, confusions):
+        a, b = annotators[i], annotators[j]
+        cm_df = pd.DataFrame(confusion, index=labels, columns=labels).rename_axis(index=a, columns=b)
+        entries.append((a, b, cm_df))
+
+    index = ['a', 'b']
+    name = 'confusion_matrix'
+    return pd.DataFrame(entries, columns=[*index, name]).set_index(index)[name]
+
+
+def annotator_unit_index(units: np.ndarray, annotators: np.ndarray,
+                         n_annotators: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns an inverted index from annotators to the units they annotated, as two arrays: the sorted unit ids of all
+    annotators, concatenated, and the offsets of every annotator's units. The units of annotator a are
+    unit_ids[offsets[a]:offsets[a + 1]].
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+        n_annotators: Number of distinct annotators.
+    """
+    n_units = units.max(initial=0) + 1
+    keys = np.unique(annotators.astype(np.int64) * n_units + units)
+    offsets = np.r_[0, np.cumsum(np.bincount(keys // n_units, minlength=n_annotators))]
+    return keys % n_units, offsets
+
+
+def kappa_from_agreement(observed, expected):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (observed - expected) / (1 - expected)
+
+
+def percentage_from_agreement(observed, expected):
+    return observed
+
+
+def coincidence_matrix(units: np.ndarray, codes: np.ndarray, n_labels: int) -> np.ndarray:
+    """
+    Returns Krippendorff's coincidence matrix of shape (labels, labels), computed from annotations in long format.
+    Only pairable values, i.e. those of units with at least two annotations, are counted.
+
+    Args:
+        units: Integer array containing a unit id for every annotation.
+        codes: Integer array containing a label id for every annotation.
+        n_labels: Number of distinct labels.
+    """
+    _, cells, values = coincidence_entries(units, codes, n_labels)
+    return np.bincount(cells, weights=values, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+
+
+def coincidence_entries(units: np.ndarray, codes: np.ndarray,
+                        n_labels: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the contributions of every unit to Krippendorff's coincidence matrix as three arrays: the unit, the cell of
+    the flattened matrix and the value of every contribution. See coincidence_matrix.
+
+    Args:
+        units: Integer array containing a unit id for every annotation.
+        codes: Integer array containing a label id for every annotation.
+        n_labels: Number of distinct labels.
+    """
+    # count every label per unit, yielding (unit, label, count) entries sorted by unit
+    unit_labels, counts = np.unique(np.stack([units, codes]), axis=1, return_counts=True)
+    entry_units, entry_codes = unit_labels
+
+    _, unit_starts, unit_sizes = np.unique(entry_units, return_index=True, return_counts=True)
+    values_per_unit = np.add.reduceat(counts, unit_starts) if len(counts) else counts
+    m = np.repeat(values_per_unit, unit_sizes)
+    pairable = m > 1
+
+    # pair every entry with all entries of its unit, including itself
+    sizes = np.repeat(unit_sizes, unit_sizes)
+    starts = np.repeat(unit_starts, unit_sizes)
+    first = np.repeat(np.arange(len(counts)), sizes)
+    second = np.repeat(starts, sizes) + np.arange(len(first)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    pair_mask = pairable[first]
+    first, second = first[pair_mask], second[pair_mask]
+
+    weights = counts[first] * counts[second] / (m[first] - 1)
+    cells = entry_codes[first] * n_labels + entry_codes[second]
+
+    # remove pairings of values with themselves
+    self_pairs = -counts[pairable] / (m[pairable] - 1)
+    self_cells = entry_codes[pairable] * (n_labels + 1)
+    return np.r_[entry_units[first], entry_units[pairable]], np.r_[cells, self_cells], np.r_[weights, self_pairs]
+
+
+def one_vs_rest_alpha(coincidences: np.ndarray) -> np.ndarray:
+    """
+    Returns Krippendorff's Alpha for every label treated as a binary category against all other labels, computed from
+    the coincidence matrix of all labels. With two categories, all levels of measurement yield the same Alpha.
+
+    Args:
+        coincidences: Coincidence matrix of shape (labels, labels).
+    """
+    n = coincidences.sum()
+    frequencies = coincidences.sum(axis=1)
+    disagreements = frequencies - np.diag(coincidences)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 - (n - 1) * disagreements / (frequencies * (n - frequencies))
+
+
+def distance_matrix(labels: List[any], frequencies: np.ndarray, level: str = 'nominal') -> np.ndarray:
+    """
+    Returns the squared distances between labels used by Krippendorff's Alpha for the given level of measurement.
+
+    Args:
+        labels: Sorted list of labels. Labels must be numeric for the levels 'interval' and 'ratio'.
+        frequencies: Number of pairable values per label, i.e. the marginals of the coincidence matrix. Leading axes
+            of batched frequencies are kept for the 'ordinal' level, which depends on them.
+        level: Level of measurement, either 'nominal', 'ordinal', 'interval' or 'ratio'.
+    """
+    if level == 'nominal':
+        return 1 - np.eye(len(labels))
+
+    if level == 'ordinal':
+        cumulative = np.cumsum(frequencies, axis=-1)
+        lower = np.minimum.outer(np.arange(len(labels)), np.arange(len(labels)))
+        upper = np.maximum.outer(np.arange(len(labels)), np.arange(len(labels)))
+        between = cumulative[..., upper] - cumulative[..., lower] + frequencies[..., lower]
+        return (between - (frequencies[..., :, None] + frequencies[..., None, :]) / 2) ** 2
+
+    if level in ('interval', 'ratio'):
+        try:
+            values = np.asarray(labels, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f'Labels must be numeric for level "{level}".')
+
+        differences = np.subtract.outer(values, values)
+        if level == 'interval':
+            return differences ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num((differences / np.add.outer(values, values)) ** 2)
+
+    raise ValueError(f'"level" must be one of {["nominal", "ordinal", "interval", "ratio"]}, but was "{level}"!')
+
+
+def krippendorff_alpha(units: np.ndarray, codes: np.ndarray, labels: List[any], level: str = 'nominal') -> float:
+    """
+    Returns Krippendorff's Alpha for annotations in long format. Memory use is proportional to the number of
+    annotations rather than to the number of units times annotators.
+
+    Args:
+        units: Integer array containing a unit id for every annotation.
+        codes: Integer array containing a label id for every annotation, i.e. its index in labels.
+        labels: Sorted list of labels.
+        level: Level of measurement, either 'nominal' (default), 'ordinal', 'interval' or 'ratio'.
+    """
+    return alpha_from_coincidences(coincidence_matrix(units, codes, len(labels)), labels, level)
+
+
+def alpha_from_coincidences(coincidences: np.ndarray, labels: List[any], level: str = 'nominal') -> float:
+    """
+    Returns Krippendorff's Alpha for the given coincidence matrix, or an array of Alphas for a batch of matrices.
+
+    Args:
+        coincidences: Coincidence matrix of shape (labels, labels), or of shape (..., labels, labels).
+        labels: Sorted list of labels.
+        level: Level of measurement, either 'nominal' (default), 'ordinal', 'interval' or 'ratio'.
+    """
+    frequencies = coincidences.sum(axis=-1)
+    n = frequencies.sum(axis=-1)
+    distances = distance_matrix(labels, frequencies, level)
+    expected = frequencies[..., :, None] * frequencies[..., None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 - (n - 1) * np.sum(coincidences * distances, axis=(-2, -1)) / np.sum(expected * distances,
+                                                                                       axis=(-2, -1))
+
+
+def bootstrap_weights(n_units: int, n_replicates: int, seed=None) -> np.ndarray:
+    """
+    Returns an integer array of shape (replicates, units) counting how often every unit is drawn in bootstrap
+    replicates, each resampling all units with replacement.
+
+    Args:
+        n_units: Number of units.
+        n_replicates: Number of replicates.
+        seed: Seed or SeedSequence of the random number generator.
+    """
+    draws = np.random.default_rng(seed).integers(0, n_units, size=(n_replicates, n_units))
+    draws += np.arange(n_replicates)[:, None] * n_units
+    return np.bincount(draws.ravel(), minlength=n_replicates * n_units).reshape(n_replicates, n_units)
+
+
+def weighted_cell_sums(weights: np.ndarray, entry_units: np.ndarray, cells: np.ndarray, values: np.ndarray,
+                       n_cells: int) -> np.ndarray:
+    """
+    Returns an array of shape (replicates, cells) summing the values of all entries per cell, every entry weighted by
+    the number of times its unit is drawn in a replicate.
+
+    Args:
+        weights: Array of shape (replicates, units), as returned by bootstrap_weights.
+        entry_units: Unit of every entry.
+        cells: Cell of every entry.
+        values: Value of every entry, or None to count entries.
+        n_cells: Number of cells.
+    """
+    order = np.argsort(cells, kind='stable')
+    entry_units, cells = entry_units[order], cells[order]
+    sums = np.zeros((len(weights), n_cells))
+    if not len(cells):
+        return sums
+
+    contributions = weights[:, entry_units].astype(np.float64)
+    if values is not None:
+        contributions *= values[order]
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+    sums[:, cells[starts]] = np.add.reduceat(contributions, starts, axis=1)
+    return sums
+
+
+def alpha_replicates(weights: np.ndarray, entry_units: np.ndarray, cells: np.ndarray, values: np.ndarray,
+                     labels: List[any], level: str = 'nominal') -> np.ndarray:
+    """
+    Returns Krippendorff's Alpha of every bootstrap replicate, given the entries of coincidence_entries.
+
+    Args:
+        weights: Array of shape (replicates, units), as returned by bootstrap_weights.
+        entry_units: Unit of every entry.
+        cells: Cell of the coincidence matrix of every entry.
+        values: Value of every entry.
+        labels: Sorted list of labels.
+        level: Level of measurement, either 'nominal' (default), 'ordinal', 'interval' or 'ratio'.
+    """
+    n_labels = len(labels)
+    coincidences = weighted_cell_sums(weights, entry_units, cells, values, n_labels * n_labels)
+    return alpha_from_coincidences(coincidences.reshape(-1, n_labels, n_labels), labels, level)
+
+
+def pairwise_replicates(weights: np.ndarray, entry_units: np.ndarray, cells: np.ndarray, n_pairs: int,
+                        n_labels: int, agreement_fn: Callable = kappa_from_agreement) -> np.ndarray:
+    """
+    Returns an array of shape (replicates, pairs, 2) containing the number of shared units and the agreement score of
+    every pair of annotators in every bootstrap replicate, given the entries of pairwise_confusion_entries.
+
+    Args:
+        weights: Array of shape (replicates, units), as returned by bootstrap_weights.
+        entry_units: Unit of every entry.
+        cells: Cell of the flattened (pairs, labels, labels) confusion array of every entry.
+        n_pairs: Number of pairs of annotators.
+        n_labels: Number of distinct labels.
+        agreement_fn: Function calculating the score from observed and expected agreement.
+    """
+    confusions = weighted_cell_sums(weights, entry_units, cells, None, n_pairs * n_labels * n_labels)
+    n, observed, expected = agreement_from_confusions(confusions.reshape(len(weights), n_pairs, n_labels, n_labels))
+    return np.stack([n, agreement_fn(observed, expected)], axis=-1)
+
+
+def bootstrap_chunk(statistic: Callable, n_units: int, n_replicates: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """Returns the statistic of n_replicates bootstrap replicates, see bootstrap."""
+    return statistic(bootstrap_weights(n_units, n_replicates, seed))
+
+
+def bootstrap_chunk_size(n_units: int, n_entries: int, n_cells: int, max_bytes: int = 100_000_000) -> int:
+    """
+    Returns the number of replicates per chunk of bootstrap for which the per-replicate arrays of a chunk, i.e. the
+    weights of all units, the weighted entries and the cell sums, take up at most max_bytes, but at least 1.
+
+    Args:
+        n_units: Number of units.
+        n_entries: Number of entries, e.g. of coincidence_entries or pairwise_confusion_entries.
+        n_cells: Number of cells the entries are summed into.
+        max_bytes: Memory budget of a chunk, defaults to 100 MB.
+    """
+    bytes_per_replicate = 8 * (2 * n_units + n_entries + n_cells)
+    return max(1, int(max_bytes // max(bytes_per_replicate, 1)))
+
+
+def bootstrap(statistic: Callable, n_units: int, n_replicates: int = 1000, seed: int = None, workers: int = None,
+              chunk_size: int = 100) -> np.ndarray:
+    """
+    Returns the results of a statistic for bootstrap replicates of units, concatenated along the first axis. Replicates
+    are drawn and evaluated in chunks, every chunk with its own random number generator derived from the seed. Results
+    for a seed are therefore the same for any number of workers.
+
+    Args:
+        statistic: Picklable function taking an array of shape (replicates, units) of weights, as returned by
+            bootstrap_weights, and returning an array with the replicates along the first axis.
+        n_units: Number of units.
+        n_replicates: Number of replicates.
+        seed: Seed or SeedSequence for reproducible replicates. If None, fresh entropy is used.
+        workers: Number of processes evaluating chunks. If None or 1, chunks are evaluated sequentially.
+        chunk_size: Number of replicates per chunk. Memory use is proportional to the chunk size, see
+            bootstrap_chunk_size.
+    """
+    sizes = [min(chunk_size, n_replicates - start) for start in range(0, n_replicates, chunk_size)]
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+
+    if workers is None or workers <= 1:
+        return np.concatenate([bootstrap_chunk(statistic, n_units, size, chunk_seed)
+                               for size, chunk_seed in zip(sizes, seeds)])
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(bootstrap_chunk, statistic, n_units, size, chunk_seed)
+                   for size, chunk_seed in zip(sizes, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+AgreementEstimate = namedtuple('AgreementEstimate', ['sample_size', 'fraction', 'estimate', 'lower', 'upper'])
+
+
+def annotator_sets(clusters: np.ndarray, annotators: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Returns an id for every cluster identifying the set of annotators with annotations in the cluster. Clusters
+    annotated by the same annotators get the same id.
+
+    Args:
+        clusters: Integer array containing a cluster id, e.g. of a sentence, per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+        n_clusters: Number of distinct clusters.
+    """
+    n_annotators = annotators.max(initial=-1) + 1
+    memberships = np.unique(clusters.astype(np.int64) * n_annotators + annotators)
+    member_clusters, member_annotators = memberships // max(n_annotators, 1), memberships % max(n_annotators, 1)
+
+    # sets as bit masks of annotators, one row of bytes per cluster
+    masks = np.zeros((n_clusters, (n_annotators + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(masks, (member_clusters, member_annotators // 8), (1 << (member_annotators % 8)).astype(np.uint8))
+    return np.unique(masks, axis=0, return_inverse=True)[1].ravel()
+
+
+def stratified_order(strata: np.ndarray, seed=None) -> np.ndarray:
+    """
+    Returns a random permutation of items such that every prefix of it is a proportionally stratified sample, i.e.
+    contains every stratum in proportion to its size, up to rounding. Items are drawn in random order within strata.
+
+    Args:
+        strata: Integer array containing a stratum id per item.
+        seed: Seed or SeedSequence of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    permutation = rng.permutation(len(strata))
+    _, permuted_strata, sizes = np.unique(strata[permutation], return_inverse=True, return_counts=True)
+
+    # rank of every item within its stratum, spread evenly over [0, 1) with a random offset per stratum
+    by_stratum = np.argsort(permuted_strata, kind='stable')
+    ranks = np.empty(len(strata), dtype=np.int64)
+    ranks[by_stratum] = np.arange(len(strata)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    offsets = rng.random(len(sizes))
+    positions = (ranks + offsets[permuted_strata]) / sizes[permuted_strata]
+    return permutation[np.argsort(positions, kind='stable')]
+
+
+def majority_vote(units: np.ndarray, codes: np.ndarray, n_units: int) -> np.ndarray:
+    """
+    Returns the most frequent label id of every unit. Ties are broken in favour of the label that occurs first in the
+    unit. Units without annotations are coded as -1.
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        codes: Integer array containing a label id per annotation, -1 for missing labels.
+        n_units: Number of distinct units.
+    """
+    valid = codes >= 0
+    units, codes = units[valid], codes[valid]
+    pairs = units * (codes.max(initial=0) + 1) + codes
+    unique_pairs, first, counts = np.unique(pairs, return_index=True, return_counts=True)
+
+    # sort the (unit, label) pairs by unit, descending count and first occurrence, then keep the first pair per unit
+    pair_units, pair_codes = units[first], codes[first]
+    order = np.lexsort((first, -counts, pair_units))
+    winners = order[np.r_[True, pair_units[order][1:] != pair_units[order][:-1]]]
+
+    consolidated = np.full(n_units, -1, dtype=np.int64)
+    consolidated[pair_units[winners]] = pair_codes[winners]
+    return consolidated
+
+
+def dawid_skene(units: np.ndarray, annotators: np.ndarray, codes: np.ndarray, n_units: int, n_labels: int,
+                max_iter: int = 100, tol: float = 1e-6) -> np.ndarray:
+    """
+    Returns an array of shape (units, labels) containing the posterior probabilities of the true label of every unit,
+    estimated with the EM algorithm of Dawid and Skene (1979). Every annotator is modelled by a confusion matrix of
+    label probabilities given the true label. Estimation is initialized with the label distribution of every unit.
+
+    Args:
+        units: Integer array containing a unit id per annotation.
+        annotators: Integer array containing an annotator id per annotation.
+        codes: Integer array containing a label id per annotation, -1 for missing labels.
+        n_units: Number of distinct units.
+        n_labels: Number of distinct labels.
+        max_iter: Maximum number of EM iterations.
+        tol: Estimation stops once no posterior probability changes by more than tol.
+    """
+    valid = codes >= 0
+    units, annotators, codes = units[valid], annotators[valid], codes[valid]
+    n_annotators = annotators.max(initial=-1) + 1
+    cells = annotators * n_labels + codes
+
+    posteriors = np.bincount(units * n_labels + codes, minlength=n_units * n_labels)\
+        .reshape(n_units, n_labels).astype(float)
+    posteriors /= np.maximum(posteriors.sum(axis=1, keepdims=True), 1)
+
+    for _ in range(max_iter):
+        # M-step: class priors and confusion matrices [annotator, true label, label], smoothed to avoid log(0)
+        priors = posteriors.mean(axis=0) + 1e-10
+        confusions = np.stack([np.bincount(cells, weights=posteriors[units, k], minlength=n_annotators * n_labels)
+                               for k in range(n_labels)]).reshape(n_labels, n_annotators, n_labels).transpose(1, 0, 2)
+        confusions += 1e-10
+        confusions /= confusions.sum(axis=2, keepdims=True)
+
+        # E-step: posterior of every true label given all annotations of a unit
+        log_likelihoods = np.log(confusions[annotators, :, codes])
+        log_posteriors = np.log(priors / priors.sum()) + np.stack(
+            [np.bincount(units, weights=log_likelihoods[:, k], minlength=n_units) for k in range(n_labels)], axis=1)
+        log_posteriors -= log_posteriors.max(axis=1, keepdims=True)
+        updated = np.exp(log_posteriors)
+        updated /= updated.sum(axis=1, keepdims=True)
+
+        converged = np.abs(updated - posteriors).max(initial=0) <= tol
+        posteriors = updated
+        if converged:
+            break
+
+    return posteriors
+
+
+class AgreementStatistics:
+    """
+    Sufficient statistics of inter-annotator agreement that are updated as annotations are added or removed, in time
+    proportional to the size of the change. Kept are the labels of every unit, the confusion counts of every pair of
+    annotators sharing units, the label counts of every annotator, and the pairs of values within units, from which
+    Krippendorff's coincidence matrix is derived. Only non-zero counts are stored, so that memory depends on the pairs
+    of annotators and labels that actually occur. Agreement measures and confusion matrices are derived on demand.
+
+    Units are tuples whose first element is the source file, e.g. (source_file, sentence, begin, end). Every annotator
+    has at most one label per unit. Labels and annotators are registered as they appear.
+    """
+
+    def __init__(self):
+        self.labels = []
+        self.annotators = []
+        self._label_ids = {}
+        self._annotator_ids = {}
+        self._units = {}  # unit -> {annotator id: label id}
+        self._file_units = {}  # source file -> set of units
+        self._label_counts = {}  # (annotator id, label id) -> number of annotations
+        self._confusions = {}  # (annotator id, annotator id), lower id first -> {(label id, label id): count}
+        self._value_pairs = {}  # number of values m of a unit -> {(label id, label id): count of ordered value pairs}
+
+    @classmethod
+    def from_annotations(cls, units: Sequence[tuple], annotators: Sequence[str], labels: Sequence[any]):
+        """
+        Returns statistics of the given annotations, computed in bulk. Later annotations of an annotator for the same
+        unit are ignored.
+
+        Args:
+            units: Unit of every annotation.
+            annotators: Annotator of every annotation.
+            labels: Label of every annotation.
+        """
+        statistics = cls()
+        for unit, annotator, label in zip(units, annotators, labels):
+            unit_labels = statistics._units.setdefault(unit, {})
+            annotator_id = statistics._annotator_id(annotator)
+            if annotator_id not in unit_labels:
+                unit_labels[annotator_id] = statistics._label_id(label)
+                statistics._file_units.setdefault(unit[0], set()).add(unit)
+
+        unit_ids, annotator_ids, codes = [], [], []
+        for unit_id, unit_labels in enumerate(statistics._units.values()):
+            unit_ids.extend([unit_id] * len(unit_labels))
+            annotator_ids.extend(unit_labels.keys())
+            codes.extend(unit_labels.values())
+        unit_ids, annotator_ids, codes = np.array(unit_ids, dtype=np.int64), np.array(annotator_ids, dtype=np.int64), \
+            np.array(codes, dtype=np.int64)
+        n_annotators, n_labels = len(statistics.annotators), len(statistics.labels)
+
+        keys, counts = np.unique(annotator_ids * n_labels + codes, return_counts=True)
+        statistics._label_counts = dict(zip(zip(*np.divmod(keys, n_labels)), counts))
+
+        pair_a, pair_b, entry_units, cells = pairwise_confusion_entries(unit_ids, annotator_ids, codes, n_annotators,
+                                                                        n_labels)
+        keys, counts = np.unique(cells, return_counts=True)
+        pairs, label_pairs = np.divmod(keys, n_labels * n_labels)
+        for pair, label_pair, count in zip(pairs, label_pairs, counts):
+            confusions = statistics._confusions.setdefault((pair_a[pair], pair_b[pair]), {})
+            confusions[divmod(label_pair, n_labels)] = count
+
+        # every pair of annotations in a unit of m values contributes both orders of its values
+        first, second = (cells // n_labels) % n_labels, cells % n_labels
+        m = np.bincount(unit_ids, minlength=len(statistics._units))[entry_units]
+        keys = np.r_[(m * n_labels + first) * n_labels + second, (m * n_labels + second) * n_labels + first]
+        keys, counts = np.unique(keys, return_counts=True)
+        for m, label_pair, count in zip(*np.divmod(keys, n_labels * n_labels), counts):
+            statistics._value_pairs.setdefault(m, {})[divmod(label_pair, n_labels)] = count
+
+        return statistics
+
+    def add(self, unit: tuple, annotator: str, label):
+        """Adds an annotation. An existing annotation of the annotator for the unit is replaced."""
+        self.remove(unit, annotator)
+        annotator_id, label_id = self._annotator_id(annotator), self._label_id(label)
+        unit_labels = self._units.setdefault(unit, {})
+        self._file_units.setdefault(unit[0], set()).add(unit)
+        self._update(unit_labels, annotator_id, label_id, 1)
+        unit_labels[annotator_id] = label_id
+
+    def remove(self, unit: tuple, annotator: str):
+        """Removes the annotation of the annotator for the unit, if there is one."""
+        unit_labels = self._units.get(unit, {})
+        annotator_id = self._annotator_ids.get(annotator)
+        if annotator_id in unit_labels:
+            self._remove(unit, unit_labels, annotator_id)
+
+    def update(self, units: Sequence[tuple], annotators: Sequence[str], labels: Sequence[any]):
+        """Adds the given annotations, see AgreementStatistics.add."""
+        for unit, annotator, label in zip(units, annotators, labels):
+            self.add(unit, annotator, label)
+
+    def remove_document(self, source_file: str, annotator: str = None):
+        """Removes all annotations of the given annotator in the given source file, or of all annotators if None."""
+        for unit in list(self._file_units.get(source_file, ())):
+            if annotator is None:
+                for other in [self.annotators[i] for i in self._units[unit]]:
+                    self.remove(unit, other)
+            else:
+                self.remove(unit, annotator)
+
+    def _remove(self, unit, unit_labels, annotator_id):
+        label_id = unit_labels.pop(annotator_id)
+        self._update(unit_labels, annotator_id, label_id, -1)
+
+        if not unit_labels:
+            del self._units[unit]
+            self._file_units[unit[0]].discard(unit)
+
+    def _update(self, unit_labels, annotator_id, label_id, sign):
+        # counts the annotation against the other annotations of its unit, given without it
+        self._count(self._label_counts, (annotator_id, label_id), sign)
+        for other_id, other_label_id in unit_labels.items():
+            if annotator_id < other_id:
+                pair, label_pair = (annotator_id, other_id), (label_id, other_label_id)
+            else:
+                pair, label_pair = (other_id, annotator_id), (other_label_id, label_id)
+            self._count(self._confusions.setdefault(pair, {}), label_pair, sign)
+            if not self._confusions[pair]:
+                del self._confusions[pair]
+
+        # all ordered value pairs of the unit are counted anew, as their weight depends on the number of values
+        m = len(unit_labels)
+        values = list(unit_labels.values())
+        self._count_value_pairs(values, m, -sign)
+        self._count_value_pairs(values + [label_id], m + 1, sign)
+
+    def _count_value_pairs(self, values, m, sign):
+        if m < 2:
+            return
+        pairs = self._value_pairs.setdefault(m, {})
+        for i, first in enumerate(values):
+            for j, second in enumerate(values):
+                if i != j:
+                    self._count(pairs, (first, second), sign)
+        if not pairs:
+            del self._value_pairs[m]
+
+    @staticmethod
+    def _count(counts, key, delta):
+        count = counts.get(key, 0) + delta
+        if count:
+            counts[key] = count
+        else:
+            del counts[key]
+
+    def _annotator_id(self, annotator):
+        if annotator not in self._annotator_ids:
+            self._annotator_ids[annotator] = len(self.annotators)
+            self.annotators.append(annotator)
+        return self._annotator_ids[annotator]
+
+    def _label_id(self, label):
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self._label_ids[label]
+
+    def _active(self):
+        # annotators and labels with at least one annotation, labels sorted as in View.labels
+        annotator_ids = np.unique(np.array([a for a, _ in self._label_counts], dtype=np.int64))
+        label_ids = np.unique(np.array([label for _, label in self._label_counts], dtype=np.int64))
+        try:
+            label_ids = np.array(sorted(label_ids, key=self.labels.__getitem__), dtype=np.int64)
+        except TypeError:
+            pass
+        return annotator_ids, label_ids
+
+    @property
+    def active_annotators(self) -> List[str]:
+        """Returns the annotators with at least one annotation."""
+        return [self.annotators[i] for i in self._active()[0]]
+
+    @property
+    def active_labels(self) -> List[any]:
+        """Returns the labels of at least one annotation, in sorted order."""
+        return [self.labels[i] for i in self._active()[1]]
+
+    def confusion_tensor(self) -> np.ndarray:
+        """
+        Returns the confusion tensor of shape (annotators, annotators, labels, labels), with axes ordered as
+        active_annotators and active_labels. Entry [a, a, i, i] counts the annotations of annotator a labelled i.
+        """
+        annotator_ids, label_ids = self._active()
+        a, b, confusions = self._pair_confusions()
+        tensor = np.zeros((len(annotator_ids), len(annotator_ids), len(label_ids), len(label_ids)), dtype=np.int64)
+        tensor[a, b] = confusions
+        tensor[b, a] = confusions.transpose(0, 2, 1)
+
+        annotator_positions, label_positions = self._positions(annotator_ids), self._positions(label_ids)
+        for (annotator_id, label_id), count in self._label_counts.items():
+            annotator, label = annotator_positions[annotator_id], label_positions[label_id]
+            tensor[annotator, annotator, label, label] = count
+        return tensor
+
+    def coincidence_matrix(self) -> np.ndarray:
+        """Returns Krippendorff's coincidence matrix, with axes ordered as active_labels."""
+        _, label_ids = self._active()
+        positions = self._positions(label_ids)
+        coincidences = np.zeros((len(label_ids), len(label_ids)))
+        for m, pairs in self._value_pairs.items():
+            for (first, second), count in pairs.items():
+                coincidences[positions[first], positions[second]] += count / (m - 1)
+        return coincidences
+
+    def iaa_pairwise(self, measure: str = 'kappa') -> pd.DataFrame:
+        """Returns pairwise agreement scores in the format of View.iaa_pairwise, either 'kappa' or 'percentage'."""
+        measures = {'kappa': kappa_from_agreement, 'percentage': percentage_from_agreement}
+        if measure not in measures:
+            raise ValueError(f'"measure" must be one of {measures.keys()}, but was "{measure}"!')
+        annotators = self.active_annotators
+        if len(annotators) < 2:
+            return pd.DataFrame([])
+
+        a, b, confusions = self._pair_confusions()
+        n, observed, expected = agreement_from_confusions(confusions)
+        scores = measures[measure](observed, expected)
+        index = pd.MultiIndex.from_arrays([np.take(annotators, a), np.take(annotators, b)], names=['a', 'b'])
+        return pd.DataFrame({'n': n, measure: scores}, index=index)
+
+    def iaa(self, measure: str = 'krippendorff', level: str = 'nominal') -> float:
+        """Returns agreement as View.iaa, either 'krippendorff', 'kappa' or 'percentage'."""
+        if measure == 'krippendorff':
+            return alpha_from_coincidences(self.coincidence_matrix(), self.active_labels, level)
+        scores = self.iaa_pairwise(measure)
+        return np.average(scores[measure], weights=scores['n'])
+
+    def confusion_matrices(self, only_differences=False, aggregate=None) -> Union[pd.Series, pd.DataFrame]:
+        """Returns confusion matrices in the format of View.confusion_matrices."""
+        annotators = self.active_annotators
+        if len(annotators) < 2:
+            return pd.Series(dtype='object')
+        return confusion_matrices_from_pairs(*self._pair_confusions(), annotators, self.active_labels,
+                                             only_differences, aggregate)
+
+    def _pair_confusions(self):
+        # confusion matrices of the pairs of annotators sharing units, as returned by pairwise_confusions, with ids
+        # referring to active_annotators and active_labels
+        annotator_ids, label_ids = self._active()
+        annotator_positions, label_positions = self._positions(annotator_ids), self._positions(label_ids)
+        pairs = sorted(self._confusions)
+        confusions = np.zeros((len(pairs), len(label_ids), len(label_ids)), dtype=np.int64)
+        for i, pair in enumerate(pairs):
+            for (first, second), count in self._confusions[pair].items():
+                confusions[i, label_positions[first], label_positions[second]] = count
+        a = np.array([annotator_positions[a] for a, _ in pairs], dtype=np.int64)
+        b = np.array([annotator_positions[b] for _, b in pairs], dtype=np.int64)
+        return a, b, confusions
+
+    @staticmethod
+    def _positions(ids):
+        return {i: position for position, i in enumerate(ids)}
+
+
+GammaResult = namedtuple('GammaResult', ['unit', 'gamma', 'error'])
+
+
+@contextmanager
+def time_limit(seconds: float = None):
+    """
+    Context manager raising a TimeoutError in the enclosed block once the given number of seconds has passed. The limit
+    is only enforced on platforms supporting SIGALRM and in the main thread of a process, and it is checked when the
+    interpreter executes Python code.
+    """
+    if not seconds or not hasattr(signal, 'SIGALRM') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handler(signum, frame):
+        # fire again shortly, in case the error is swallowed, e.g. when raised inside a finalizer
+        signal.setitimer(signal.ITIMER_REAL, 0.1)
+        raise TimeoutError(f'Exceeded time limit of {seconds} seconds.')
+
+    previous_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def gamma_for_unit(unit, annotations: List[tuple], timeout: float = None) -> GammaResult:
+    """
+    Returns a GammaResult containing the gamma agreement for the continuum of a single unit. If gamma cannot be
+    calculated, gamma is NaN and the error describes the cause.
+
+    Args:
+        unit: Identifier of the unit, e.g. a sentence id.
+        annotations: List of tuples (annotator, begin, end, annotation) making up the continuum.
+        timeout: Maximum number of seconds to spend on the unit. See time_limit for restrictions.
+    """
+    try:
+        with time_limit(timeout):
+            continuum = Continuum()
+            for annotator, begin, end, annotation in annotations:
+                continuum.add(annotator, Segment(begin, end), annotation)
+            gamma = continuum.compute_gamma(CombinedCategoricalDissimilarity(), fast=True).gamma
+    except Exception as e:
+        return GammaResult(unit, np.nan, repr(e))
+
+    return GammaResult(unit, gamma, None)
+
+
+def gamma_by_label_for_unit(unit, annotations: List[tuple], timeout: float = None) -> List[GammaResult]:
+    """
+    Returns a GammaResult per label of a single unit, containing the gamma agreement of the continuum of the annotations
+    with that label. Results are identified by tuples (unit, label).
+
+    Args:
+        unit: Identifier of the unit, e.g. a sentence id.
+        annotations: List of tuples (annotator, begin, end, annotation) making up the continuum.
+        timeout: Maximum number of seconds to spend on every label. See time_limit for restrictions.
+    """
+    by_label = {}
+    for annotation in annotations:
+        by_label.setdefault(annotation[3], []).append(annotation)
+    return [gamma_for_unit((unit, label), label_annotations, timeout)
+            for label, label_annotations in by_label.items()]
+
+
+def iter_gamma_agreement(annotation_df: pd.DataFrame, workers: int = None, timeout: float = None,
+                         by_label: bool = False):
+    """
+    Computes gamma agreement for every sentence of the given annotations, yielding a GammaResult per sentence as soon
+    as it is available. Failing sentences do not interrupt the computation, their results contain the error instead.
+
+    Args:
+        annotation_df: DataFrame with the columns sentence, annotator, begin, end and annotation.
+        workers: Number of processes used to compute gamma. If None or 1, sentences are processed sequentially in
+            sentence order, otherwise results are yielded in order of completion.
+        timeout: Maximum number of seconds to spend on a single sentence.
+        by_label: If True, gamma is computed separately for the annotations of every label in a sentence, yielding a
+            GammaResult per (sentence, label). All labels of a sentence are computed by the same task.
+    """
+    continuum_dfs = annotation_df[['sentence', 'annotator', 'begin', 'end', 'annotation']].groupby('sentence')
+    units = [(sentence, list(df[['annotator', 'begin', 'end', 'annotation']].itertuples(index=False, name=None)))
+             for sentence, df in continuum_dfs]
+    gamma_fn = gamma_by_label_for_unit if by_label else gamma_for_unit
+
+    if workers is None or workers <= 1:
+        for unit, annotations in units:
+            if by_label:
+                yield from gamma_fn(unit, annotations, timeout)
+            else:
+                yield gamma_fn(unit, annotations, timeout)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(gamma_fn, unit, annotations, timeout): (unit, annotations)
+                   for unit, annotations in units}
+        for future in as_completed(futures):
+            unit, annotations = futures[future]
+            try:
+                if by_label:
+                    yield from future.result()
+                else:
+                    yield future.result()
+            except Exception as e:  # e.g. a worker process died
+                if by_label:
+                    for label in dict.fromkeys(annotation[3] for annotation in annotations):
+                        yield GammaResult((unit, label), np.nan, repr(e))
+                else:
+                    yield GammaResult(unit, np.nan, repr(e))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def gamma_agreement(annotation_df: pd.DataFrame, workers: int = None, timeout: float = None) -> float:
+    """
+    Returns the mean gamma agreement over all sentences of the given annotations. Sentences for which gamma cannot be
+    calculated are skipped and logged as warnings. Use iter_gamma_agreement to access per sentence results.
+
+    Args:
+        annotation_df: DataFrame with the columns sentence, annotator, begin, end and annotation.
+        workers: Number of processes used to compute gamma. If None or 1, sentences are processed sequentially.
+        timeout: Maximum number of seconds to spend on a single sentence.
+    """
+    gammas = {}
+    for unit, gamma, error in iter_gamma_agreement(annotation_df, workers, timeout):
+        if error is None:
+            gammas[unit] = gamma
+        else:
+            logger.warning(f'Could not calculate gamma for sentence "{unit}" ({error}). Skipping.')
+
+    return np.mean([gammas[unit] for unit in sorted(gammas)])
+
+
+def gamma_agreement_by_label(annotation_df: pd.DataFrame, workers: int = None, timeout: float = None) -> pd.Series:
+    """
+    Returns a Series containing the mean gamma agreement over all sentences for every label, considering only the
+    annotations with that label. Sentences and annotations are collected once for all labels. Results for which gamma
+    cannot be calculated are skipped and logged as warnings.
+
+    Args:
+        annotation_df: DataFrame with the columns sentence, annotator, begin, end and annotation.
+        workers: Number of processes used to compute gamma. If None or 1, sentences are processed sequentially.
+        timeout: Maximum number of seconds to spend on a single label of a sentence.
+    """
+    gammas = {}
+    for (unit, label), gamma, error in iter_gamma_agreement(annotation_df, workers, timeout, by_label=True):
+        if error is None:
+            gammas.setdefault(label, {})[unit] = gamma
+        else:
+            logger.warning(f'Could not calculate gamma for label "{label}" in sentence "{unit}" ({error}). Skipping.')
 
-    return np.mean(gammas)
+    return pd.Series({label: np.mean([unit_gammas[unit] for unit in sorted(unit_gammas)])
+                      for label, unit_gammas in gammas.items()}, dtype=np.float64)